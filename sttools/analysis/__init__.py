@@ -13,9 +13,11 @@
 import logging
 
 # Submodules
-from sttools.analysis.beams import Beams
+from sttools.analysis.apersigma import AperSigma
+from sttools.analysis.beams     import Beams
+from sttools.analysis.turndata  import TurnData
 
-__all__ = ["Beams"]
+__all__ = ["AperSigma","Beams","TurnData"]
 
 # Logging
 logger = logging.getLogger(__name__)
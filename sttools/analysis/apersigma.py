@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*
+"""Python Toolbox for SixTrack, Aperture in Beam Sigma
+
+  SixTrack Tools - Aperture in Beam Sigma
+ =========================================
+  Tools for computing the available aperture in units of beam sigma
+  By: Veronica Berglyd Olsen
+      CERN (BE-ABP-HSS)
+      Geneva, Switzerland
+
+  The twiss functions BETX, BETY, DX and DY, and the closed orbit X and Y if present, are linearly
+  interpolated from a twiss TableFS onto the s positions of the aperture table. The beam size in
+  each plane is then
+    sigma = sqrt(beta * emittance/(beta*gamma) + (D * deltaP)^2)
+  and the available aperture is the aperture half-width minus the closed orbit, in units of sigma.
+  Elements with apertype NONE are excluded. Sliced elements, named ELEMENT..k, are reported as
+  their parent element, using the smallest aperture of their slices.
+
+"""
+
+import logging
+import numpy as np
+
+from sttools.constants import Const
+
+# Logging
+logger = logging.getLogger(__name__)
+
+class AperSigma():
+
+    def __init__(self, aperData, twissData):
+
+        self.aperData  = aperData
+        self.twissData = twissData
+        self.twissCols = {}
+        self.isValid   = False
+
+        if self.aperData.aperX is None:
+            self.aperData.parseAperture()
+
+        for tN in ("BETX","BETY","DX","DY","X","Y"):
+            if tN in twissData.varNames:
+                continue
+            if tN in ("BETX","BETY"):
+                logger.error("Twiss table has no %s column" % tN)
+                return
+            logger.debug("Twiss table has no %s column, assuming zero" % tN)
+
+        self._alignTwiss()
+        self.isValid = True
+
+        return
+
+    def sigmaProfile(self, normEmit, beamEnergy, deltaP=0.0, partMass=Const.ProtonMass):
+        """Computes the available aperture in sigma along the aperture table for a batch of beam
+        configurations. normEmit [m], beamEnergy [eV] and deltaP can be scalars or arrays of the
+        same length. The normEmittance and beamEnergy lists of LHCOptics can be passed directly,
+        which gives one configuration per beam. Returns two arrays of shape (nConfig, nElements)
+        for the horizontal and vertical planes, with NaN for elements without aperture.
+        """
+
+        if not self.isValid:
+            logger.error("No valid aperture and twiss tables")
+            return None, None
+
+        normEmit, beamEnergy, deltaP = np.broadcast_arrays(
+            np.atleast_1d(np.asarray(normEmit,dtype="float")),
+            np.atleast_1d(np.asarray(beamEnergy,dtype="float")),
+            np.atleast_1d(np.asarray(deltaP,dtype="float")),
+        )
+
+        beamGamma = beamEnergy/partMass
+        geomEmit  = normEmit/np.sqrt(beamGamma**2 - 1.0)
+
+        sigX = np.sqrt(
+            np.outer(geomEmit,self.twissCols["BETX"]) + np.outer(deltaP,self.twissCols["DX"])**2
+        )
+        sigY = np.sqrt(
+            np.outer(geomEmit,self.twissCols["BETY"]) + np.outer(deltaP,self.twissCols["DY"])**2
+        )
+
+        hasAper = (self.aperData.aperX > 0.0) & (self.aperData.aperY > 0.0)
+        aperX   = np.where(hasAper,self.aperData.aperX - np.abs(self.twissCols["X"]),np.nan)
+        aperY   = np.where(hasAper,self.aperData.aperY - np.abs(self.twissCols["Y"]),np.nan)
+
+        return aperX/sigX, aperY/sigY
+
+    def findBottlenecks(self, normEmit, beamEnergy, deltaP=0.0, nBottle=1, partMass=Const.ProtonMass):
+        """Finds the nBottle elements with the smallest aperture in sigma in each plane, for a
+        batch of beam configurations. Returns a dictionary with the element names, s positions and
+        aperture in sigma as arrays of shape (nConfig, nBottle) for each plane.
+        """
+
+        nSigX, nSigY = self.sigmaProfile(normEmit,beamEnergy,deltaP,partMass)
+        if nSigX is None:
+            return None
+
+        # Group the rows by element, and take the smallest value of each group
+        elemName, elemInv = np.unique(self._parentNames(),return_inverse=True)
+        rowOrder = np.argsort(elemInv,kind="stable")
+        grpBeg   = np.searchsorted(elemInv[rowOrder],np.arange(len(elemName)))
+        elemS    = np.minimum.reduceat(self.aperData.aperS[rowOrder],grpBeg)
+
+        theResult = {}
+        for pN, nSig in (("X",nSigX),("Y",nSigY)):
+            elemSig  = np.fmin.reduceat(nSig[:,rowOrder],grpBeg,axis=1)
+            sigOrder = np.argsort(elemSig,axis=1,kind="stable")[:,:nBottle]
+            theResult["NAME"+pN] = elemName[sigOrder]
+            theResult["S"+pN]    = elemS[sigOrder]
+            theResult["SIG"+pN]  = np.take_along_axis(elemSig,sigOrder,axis=1)
+
+        return theResult
+
+    #
+    #  Internal Functions
+    #
+
+    def _alignTwiss(self):
+        """Interpolates the twiss columns onto the s positions of the aperture table.
+        """
+        twissS = np.asarray(self.twissData.Data["S"],dtype="float")
+        sOrder = np.argsort(twissS,kind="stable")
+        for tN in ("BETX","BETY","DX","DY","X","Y"):
+            if tN in self.twissData.varNames:
+                tData = np.asarray(self.twissData.Data[tN],dtype="float")[sOrder]
+                self.twissCols[tN] = np.interp(self.aperData.aperS,twissS[sOrder],tData)
+            else:
+                self.twissCols[tN] = np.zeros(self.aperData.aperN)
+        return
+
+    def _parentNames(self):
+        """Returns the aperture element names with the slice number removed.
+        """
+        elemName = np.asarray(self.aperData.aperData.Data["NAME"]).astype("str")
+        nameSplt = np.char.partition(elemName,"..")
+        isSliced = (nameSplt[:,1] == "..") & np.char.isdigit(nameSplt[:,2])
+        return np.where(isSliced,nameSplt[:,0],elemName)
+
+# END Class AperSigma
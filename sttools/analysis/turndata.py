@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*
+"""Python Toolbox for SixTrack, Turn-by-Turn Data
+
+  SixTrack Tools - Turn-by-Turn Data
+ ====================================
+  Tools for regrouping dump data into particle and turn arrays
+  By: Veronica Berglyd Olsen
+      CERN (BE-ABP-HSS)
+      Geneva, Switzerland
+
+  Dump data is stored as a flat list of rows of particle ID, turn and coordinates. These tools
+  scatter the rows into a tensor of shape (nPart, nTurn, nCoord), where the particles and turns are
+  sorted by ID and turn number. Entries for particles that were lost before a turn are set to NaN,
+  or masked.
+
+"""
+
+import logging
+import numpy as np
+import h5py
+
+from os import path
+
+# Logging
+logger = logging.getLogger(__name__)
+
+class TurnData():
+
+    COORDS = ["X","XP","Y","YP","Z","DEE"]
+
+    @staticmethod
+    def buildTensor(dumpData, colNames=COORDS, maskLost=True):
+        """Builds a (nPart, nTurn, nCoord) tensor from dump data in memory. The dump data can be a
+        dictionary of arrays like STDump.allData, a record array, or an HDF5 dump dataset. If
+        maskLost is True and particles are missing on some turns, a masked array is returned.
+        Returns the tensor, and the sorted particle IDs and turn numbers of its first two axes.
+        """
+
+        partID  = np.asarray(dumpData["ID"])
+        turnNum = np.asarray(dumpData["TURN"])
+
+        partIDs  = np.unique(partID)
+        turnNums = np.unique(turnNum)
+        partIdx  = np.searchsorted(partIDs,partID)
+        turnIdx  = np.searchsorted(turnNums,turnNum)
+
+        theTensor = np.full((len(partIDs),len(turnNums),len(colNames)),np.nan)
+        for c, cN in enumerate(colNames):
+            theTensor[partIdx,turnIdx,c] = dumpData[cN]
+
+        if maskLost:
+            isSet = np.zeros((len(partIDs),len(turnNums)),dtype=bool)
+            isSet[partIdx,turnIdx] = True
+            if not isSet.all():
+                logger.debug("%d particle turns are missing" % np.count_nonzero(~isSet))
+                theMask   = np.repeat(~isSet[:,:,np.newaxis],len(colNames),axis=2)
+                theTensor = np.ma.masked_array(theTensor,mask=theMask)
+
+        return theTensor, partIDs, turnNums
+
+    @staticmethod
+    def writeTensor(dumpSource, outFile, colNames=COORDS, chunkSize=1000000):
+        """Writes a (nPart, nTurn, nCoord) tensor to disk without holding the dump data in memory.
+        The source is read twice in chunks of chunkSize rows, first to find all particle IDs and
+        turn numbers, then to scatter the coordinates. The source can be an STDump object, an HDF5
+        dump dataset, a record array or a dictionary of arrays. Missing entries are NaN.
+
+        If outFile ends with .npy, the tensor is written as a memory mappable NumPy file, with the
+        particle IDs and turn numbers in .ID.npy and .TURN.npy files next to it. Otherwise, it is
+        written to an HDF5 file as the datasets tensor, ID and TURN.
+        Returns the sorted particle IDs and turn numbers.
+        """
+
+        # First pass: find all particles and turns
+        partIDs  = np.zeros(0,dtype="int")
+        turnNums = np.zeros(0,dtype="int")
+        for chunkData in TurnData._iterSource(dumpSource,["ID","TURN"],chunkSize):
+            partIDs  = np.union1d(partIDs,chunkData["ID"])
+            turnNums = np.union1d(turnNums,chunkData["TURN"])
+
+        tShape = (len(partIDs),len(turnNums),len(colNames))
+        logger.info("Writing tensor of %d particles, %d turns and %d coordinates" % tShape)
+
+        fBase, fExt = path.splitext(outFile)
+        if fExt == ".npy":
+            h5File    = None
+            theTensor = np.lib.format.open_memmap(outFile,mode="w+",dtype="float64",shape=tShape)
+            theTensor[:] = np.nan
+            np.save(fBase+".ID.npy",partIDs)
+            np.save(fBase+".TURN.npy",turnNums)
+        else:
+            # Keep at least one row of chunks across all particles in the chunk cache
+            tChunks   = (max(min(tShape[0],256),1),max(min(tShape[1],256),1),max(tShape[2],1))
+            rowBytes  = -(-tShape[0]//tChunks[0])*int(np.prod(tChunks))*8
+            h5File    = h5py.File(
+                outFile,mode="w",rdcc_nbytes=min(max(rowBytes,1024**2),1024**3),rdcc_nslots=10007
+            )
+            theTensor = h5File.create_dataset(
+                "tensor",shape=tShape,dtype="float64",fillvalue=np.nan,chunks=tChunks
+            )
+            h5File.create_dataset("ID",data=partIDs)
+            h5File.create_dataset("TURN",data=turnNums)
+
+        # Second pass: scatter the coordinates
+        for chunkData in TurnData._iterSource(dumpSource,["ID","TURN"]+colNames,chunkSize):
+            partIdx = np.searchsorted(partIDs,chunkData["ID"])
+            turnIdx = np.searchsorted(turnNums,chunkData["TURN"])
+            colData = np.stack([chunkData[cN] for cN in colNames],axis=1)
+            if h5File is None:
+                theTensor[partIdx,turnIdx,:] = colData
+            else:
+                TurnData._writeBlocks(theTensor,partIdx,turnIdx,colData,chunkSize)
+
+        if h5File is None:
+            theTensor.flush()
+            del theTensor
+        else:
+            h5File.close()
+
+        return partIDs, turnNums
+
+    #
+    #  Internal Functions
+    #
+
+    @staticmethod
+    def _writeBlocks(theTensor, partIdx, turnIdx, colData, chunkSize):
+        """Writes a chunk of rows to an HDF5 tensor as dense hyperslabs. The rows are sorted by
+        turn and split into bands of turns, which span a whole row of HDF5 chunks if it holds no
+        more than a few times chunkSize entries. Each band is read, filled in memory, and written
+        back as one block, so entries written by earlier chunks are kept.
+        """
+        nPart = theTensor.shape[0]
+        tBand = theTensor.chunks[1]
+        if nPart*tBand > 4*chunkSize:
+            tBand = max(1,(4*chunkSize)//nPart)
+
+        rowOrder = np.argsort(turnIdx,kind="stable")
+        partIdx  = partIdx[rowOrder]
+        turnIdx  = turnIdx[rowOrder]
+        colData  = colData[rowOrder]
+
+        bandBeg = np.arange(turnIdx[0]-turnIdx[0] % tBand,turnIdx[-1]+1,tBand)
+        rowBeg  = np.searchsorted(turnIdx,bandBeg,side="left")
+        rowEnd  = np.searchsorted(turnIdx,bandBeg+tBand,side="left")
+        for r0, r1 in zip(rowBeg,rowEnd):
+            if r0 == r1:
+                continue
+            pIdx = partIdx[r0:r1]
+            tIdx = turnIdx[r0:r1]
+            pBeg, pEnd = pIdx.min(), pIdx.max()+1
+            tBeg, tEnd = tIdx[0], tIdx[-1]+1
+            theBlock = theTensor[pBeg:pEnd,tBeg:tEnd,:]
+            theBlock[pIdx-pBeg,tIdx-tBeg,:] = colData[r0:r1]
+            theTensor[pBeg:pEnd,tBeg:tEnd,:] = theBlock
+
+        return
+
+    @staticmethod
+    def _iterSource(dumpSource, colNames, chunkSize):
+        """Yields chunks of at most chunkSize rows of the requested columns from a dump source.
+        """
+        if hasattr(dumpSource,"iterChunks"):
+            for chunkData in dumpSource.iterChunks(chunkSize,columns=colNames):
+                yield chunkData
+        elif isinstance(dumpSource,dict):
+            for i in range(0,len(dumpSource["ID"]),chunkSize):
+                yield {cN:dumpSource[cN][i:i+chunkSize] for cN in colNames}
+        elif isinstance(dumpSource,h5py.Dataset):
+            for i in range(0,len(dumpSource),chunkSize):
+                yield dumpSource.fields(colNames)[i:i+chunkSize]
+        else:
+            for i in range(0,len(dumpSource),chunkSize):
+                yield dumpSource[i:i+chunkSize]
+
+# END Class TurnData
@@ -13,13 +13,16 @@
 import logging
 
 # Submodules
-from sttools.filetools.aperture import Aperture
-from sttools.filetools.colmaps  import STColMaps
-from sttools.filetools.stdump   import STDump
-from sttools.filetools.tablefs  import TableFS
-from sttools.filetools.wrapper  import FileWrapper, SimWrapper
+from sttools.filetools.aperture  import Aperture
+from sttools.filetools.colcache  import ColCache
+from sttools.filetools.colmaps   import STColMaps
+from sttools.filetools.sposindex import SPosIndex
+from sttools.filetools.stdump    import STDump
+from sttools.filetools.stdumpbin import STDumpBin
+from sttools.filetools.tablefs   import TableFS
+from sttools.filetools.wrapper   import FileWrapper, SimWrapper
 
-__all__ = ["Aperture","STColMaps","STDump","TableFS","FileWrapper","SimWrapper"]
+__all__ = ["Aperture","ColCache","STColMaps","SPosIndex","STDump","STDumpBin","TableFS","FileWrapper","SimWrapper"]
 
 # Logging
 logger = logging.getLogger(__name__)
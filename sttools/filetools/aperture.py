@@ -14,13 +14,23 @@ import logging
 import numpy   as np
 import re
 
-from os                        import path
-from sttools.filetools.tablefs import TableFS
+from os                          import path, stat
+from threading                   import Lock
+from collections                 import OrderedDict
+from sttools.functions           import openFile
+from sttools.filetools.tablefs   import TableFS
+from sttools.filetools.sposindex import SPosIndex
 
 logger = logging.getLogger(__name__)
 
 class Aperture:
 
+    # Custom aperture profiles shared by all Aperture objects
+    PROFILE_MAX   = 64
+    PROFILE_LOCK  = Lock()
+    PROFILE_CACHE = OrderedDict()
+    PROFILE_FILES = {}
+
     filePath   = None # Folder where aperture file is saved
     fileName   = None # Name of aperture file
     fileLoaded = None # Set to True after file is successfully loaded
@@ -34,8 +44,9 @@ class Aperture:
     aperN      = None # Number of elements
 
     customAper = None # Storage for custom apertypes
+    sIndex     = None # The s position index of the aperture table
 
-    def __init__(self, filePath, fileName):
+    def __init__(self, filePath, fileName, colCache=None):
 
         # Defaults
         self.fileLoaded = False
@@ -54,58 +65,117 @@ class Aperture:
         else:
             logger.error("Found no %s file in path", fileName)
 
-        self.aperData   = TableFS(path.join(self.filePath,self.fileName))
+        self.aperData   = TableFS(path.join(self.filePath,self.fileName),colCache=colCache)
         self.fileLoaded = True
 
         return
 
     def parseAperture(self):
 
-        # Pre-allocate arrays
+        aperType = self.aperData.Data["APERTYPE"]
+        aperOne  = np.asarray(self.aperData.Data["APER_1"],dtype="float")
+        aperTwo  = np.asarray(self.aperData.Data["APER_2"],dtype="float")
+        aperThr  = np.asarray(self.aperData.Data["APER_3"],dtype="float")
+        aperFou  = np.asarray(self.aperData.Data["APER_4"],dtype="float")
+
         self.aperN = self.aperData.nLines
-        self.aperS = np.zeros(self.aperN)
+        self.aperS = np.array(self.aperData.Data["S"],dtype="float")
         self.aperX = np.zeros(self.aperN)
         self.aperY = np.zeros(self.aperN)
 
-        for n in range(self.aperN):
-
-            aperName = self.aperData.Data["NAME"][n]
-            aperKeyw = self.aperData.Data["KEYWORD"][n]
-            aperType = self.aperData.Data["APERTYPE"][n]
-
-            self.aperS[n] = self.aperData.Data["S"][n]
-
-            if   aperType == "CIRCLE":
-                self.aperX[n] = self.aperData.Data["APER_1"][n]
-                self.aperY[n] = self.aperData.Data["APER_1"][n]
-            elif aperType == "RECTANGLE":
-                self.aperX[n] = self.aperData.Data["APER_1"][n]
-                self.aperY[n] = self.aperData.Data["APER_2"][n]
-            elif aperType == "ELLIPSE":
-                self.aperX[n] = self.aperData.Data["APER_1"][n]
-                self.aperY[n] = self.aperData.Data["APER_2"][n]
-            elif aperType == "RECTELLIPSE":
-                self.aperX[n] = min(self.aperData.Data["APER_1"][n], self.aperData.Data["APER_3"][n])
-                self.aperY[n] = min(self.aperData.Data["APER_2"][n], self.aperData.Data["APER_4"][n])
-            elif aperType == "RACETRACK":
-                self.aperX[n] = self.aperData.Data["APER_1"][n] + self.aperData.Data["APER_3"][n]
-                self.aperY[n] = self.aperData.Data["APER_2"][n] + self.aperData.Data["APER_4"][n]
-            elif aperType == "NONE":
-                self.aperX[n] = 0.0
-                self.aperY[n] = 0.0
+        # Standard apertypes, NONE is left at zero
+        isType = aperType == "CIRCLE"
+        self.aperX[isType] = aperOne[isType]
+        self.aperY[isType] = aperOne[isType]
+
+        isType = (aperType == "RECTANGLE") | (aperType == "ELLIPSE")
+        self.aperX[isType] = aperOne[isType]
+        self.aperY[isType] = aperTwo[isType]
+
+        isType = aperType == "RECTELLIPSE"
+        self.aperX[isType] = np.minimum(aperOne[isType],aperThr[isType])
+        self.aperY[isType] = np.minimum(aperTwo[isType],aperFou[isType])
+
+        isType = aperType == "RACETRACK"
+        self.aperX[isType] = aperOne[isType] + aperThr[isType]
+        self.aperY[isType] = aperTwo[isType] + aperFou[isType]
+
+        # Custom apertypes are resolved once per type name
+        isCustom = ~np.isin(aperType,["CIRCLE","RECTANGLE","ELLIPSE","RECTELLIPSE","RACETRACK","NONE"])
+        custType, custInv = np.unique(aperType[isCustom],return_inverse=True)
+        custX = np.full(len(custType),9.999)
+        custY = np.full(len(custType),9.999)
+        for c, cT in enumerate(custType):
+            wasFound, aperData = self.customAperture(cT)
+            if wasFound:
+                # This assumes the shape is an octagon:
+                custX[c] = aperData["MaxX"]
+                custY[c] = aperData["MaxY"]
             else:
-                wasFound, aperData = self.customAperture(aperType)
-                if wasFound:
-                    # This assumes the shape is an octagon:
-                    self.aperX[n] = aperData["MaxX"]
-                    self.aperY[n] = aperData["MaxY"]
-                else:
-                    logger.warning("Unhandled APERTYPE '%s'" % aperType)
-                    self.aperX[n] = 9.999
-                    self.aperY[n] = 9.999
+                logger.warning("Unhandled APERTYPE '%s'" % cT)
+        self.aperX[isCustom] = custX[custInv]
+        self.aperY[isCustom] = custY[custInv]
 
         return True
 
+    def checkLost(self, sPos, xPos, yPos):
+        """
+        Tests arrays of particle coordinates against the aperture of the element at each s
+        position, and returns a boolean array that is True for particles outside the aperture.
+        The standard apertypes are tested in closed form, and custom apertypes are tested against
+        their full polygon. Points in elements with apertype NONE, or outside the table, are kept.
+        """
+
+        sPos = np.asarray(sPos,dtype="float")
+        xPos = np.asarray(xPos,dtype="float")
+        yPos = np.asarray(yPos,dtype="float")
+
+        if self.sIndex is None:
+            self.sIndex = SPosIndex(self.aperData,mergeSlices=False)
+
+        pRows  = self.sIndex.findRows(sPos)
+        isLost = np.zeros(len(sPos),dtype="bool")
+        isIn   = pRows >= 0
+        pRows  = pRows[isIn]
+        pIdx   = np.flatnonzero(isIn)
+
+        aperType = self.aperData.Data["APERTYPE"]
+        aperPars = np.stack([
+            np.asarray(self.aperData.Data["APER_%d" % i],dtype="float") for i in range(1,5)
+        ],axis=1)
+        typeName, typeCode = np.unique(aperType,return_inverse=True)
+        pCode = typeCode[pRows]
+
+        for t, tN in enumerate(typeName):
+            onType = pCode == t
+            if not onType.any() or tN == "NONE":
+                continue
+            tIdx = pIdx[onType]
+            pX   = np.abs(xPos[tIdx])
+            pY   = np.abs(yPos[tIdx])
+            pA   = aperPars[pRows[onType]]
+            if   tN == "CIRCLE":
+                tLost = pX**2 + pY**2 > pA[:,0]**2
+            elif tN == "RECTANGLE":
+                tLost = (pX > pA[:,0]) | (pY > pA[:,1])
+            elif tN == "ELLIPSE":
+                tLost = self._ellipseNorm(pX,pY,pA[:,0],pA[:,1]) > 1.0
+            elif tN == "RECTELLIPSE":
+                tLost = (pX > pA[:,0]) | (pY > pA[:,1]) | (self._ellipseNorm(pX,pY,pA[:,2],pA[:,3]) > 1.0)
+            elif tN == "RACETRACK":
+                dX    = np.maximum(pX - pA[:,0],0.0)
+                dY    = np.maximum(pY - pA[:,1],0.0)
+                tLost = self._ellipseNorm(dX,dY,pA[:,2],pA[:,3]) > 1.0
+            else:
+                wasFound, custData = self.customAperture(tN)
+                if not wasFound:
+                    logger.warning("Unhandled APERTYPE '%s', particles are kept" % tN)
+                    continue
+                tLost = ~self._inPolygon(xPos[tIdx],yPos[tIdx],custData)
+            isLost[tIdx] = tLost
+
+        return isLost
+
     def customAperture(self, aperType):
 
         if aperType in self.customAper.keys():
@@ -113,27 +183,65 @@ class Aperture:
         else:
             logger.info("Unknown apertype '%s', looking for definition file", aperType)
 
-        fnOrig  = path.join(self.typePath,aperType)
-        fnLower = path.join(self.typePath,aperType.lower())
-        fnUpper = path.join(self.typePath,aperType.upper())
-
-        if   path.isfile(fnOrig):
-            toLoad = fnOrig
-        elif path.isfile(fnLower):
-            toLoad = fnLower
-        elif path.isfile(fnUpper):
-            toLoad = fnUpper
-        else:
+        toLoad = self._findTypeFile(aperType)
+        if toLoad is None:
             logger.error("No file matching apertype '%s' found in folder: %s" % (aperType,self.typePath))
             logger.error("If files are stored elsewhere, set the correct path with method setTypePath()")
             return False, None
 
+        aperData = self._loadProfile(toLoad)
+        self.customAper[aperType] = aperData
+
+        return True, aperData
+
+    #
+    # Internal Functions
+    #
+
+    def _findTypeFile(self, aperType):
+        """
+        Returns the path of the definition file of a custom apertype. The file name found for each
+        apertype and folder is remembered by all Aperture objects, as long as the file exists.
+        """
+
+        probeKey = (self.typePath, aperType)
+        with Aperture.PROFILE_LOCK:
+            toLoad = Aperture.PROFILE_FILES.get(probeKey,None)
+        if toLoad is not None and path.isfile(toLoad):
+            return toLoad
+
+        toLoad = None
+        for typeName in (aperType, aperType.lower(), aperType.upper()):
+            if path.isfile(path.join(self.typePath,typeName)):
+                toLoad = path.join(self.typePath,typeName)
+                break
+        if toLoad is None:
+            return None
+
+        with Aperture.PROFILE_LOCK:
+            Aperture.PROFILE_FILES[probeKey] = toLoad
+
+        return toLoad
+
+    def _loadProfile(self, toLoad):
+        """
+        Loads a custom aperture profile through the process wide LRU cache, which is keyed by the
+        resolved file path and its modification time. Together with the coordinates, the cache
+        holds the polygon edges, the bounding box, and whether the polygon is convex.
+        """
+
+        profKey = (path.realpath(toLoad), stat(toLoad).st_mtime_ns)
+        with Aperture.PROFILE_LOCK:
+            if profKey in Aperture.PROFILE_CACHE.keys():
+                Aperture.PROFILE_CACHE.move_to_end(profKey)
+                return Aperture.PROFILE_CACHE[profKey]
+
         logger.info("Found aperture file '%s'" % path.basename(toLoad))
 
         xCoords = []
         yCoords = []
 
-        with open(toLoad,"r") as inFile:
+        with openFile(toLoad,"rt") as inFile:
             for theLine in inFile:
                 xySplit = theLine.split()
                 if len(xySplit) == 2:
@@ -143,15 +251,72 @@ class Aperture:
         xCoords = np.asarray(xCoords,dtype="float")
         yCoords = np.asarray(yCoords,dtype="float")
 
+        polyEdges = np.stack([xCoords,yCoords,np.roll(xCoords,-1),np.roll(yCoords,-1)],axis=1)
+        edgeCross = (
+            (polyEdges[:,2]-polyEdges[:,0])*(np.roll(polyEdges[:,3],-1)-polyEdges[:,1])
+            - (polyEdges[:,3]-polyEdges[:,1])*(np.roll(polyEdges[:,2],-1)-polyEdges[:,0])
+        )
+        edgeCross = edgeCross[edgeCross != 0.0]
+
         aperData = {
-            "X"    : xCoords,
-            "Y"    : yCoords,
-            "MaxX" : max(abs(xCoords)),
-            "MaxY" : max(abs(yCoords)),
+            "X"      : xCoords,
+            "Y"      : yCoords,
+            "MaxX"   : max(abs(xCoords)),
+            "MaxY"   : max(abs(yCoords)),
+            "Edges"  : polyEdges,
+            "Convex" : bool((edgeCross > 0.0).all() or (edgeCross < 0.0).all()),
+            "BBox"   : (xCoords.min(),xCoords.max(),yCoords.min(),yCoords.max()),
         }
-        self.customAper[aperType] = aperData
 
-        return True, aperData
+        with Aperture.PROFILE_LOCK:
+            Aperture.PROFILE_CACHE[profKey] = aperData
+            while len(Aperture.PROFILE_CACHE) > Aperture.PROFILE_MAX:
+                Aperture.PROFILE_CACHE.popitem(last=False)
+
+        return aperData
+
+    def _ellipseNorm(self, xPos, yPos, xAxis, yAxis):
+        """
+        Returns (x/a)^2 + (y/b)^2, where an axis of zero length only accepts a coordinate of zero.
+        """
+        with np.errstate(divide="ignore",invalid="ignore"):
+            xNorm = np.where(xAxis > 0.0,(xPos/xAxis)**2,np.where(xPos > 0.0,np.inf,0.0))
+            yNorm = np.where(yAxis > 0.0,(yPos/yAxis)**2,np.where(yPos > 0.0,np.inf,0.0))
+        return xNorm + yNorm
+
+    def _inPolygon(self, xPos, yPos, custData):
+        """
+        Tests points against a custom aperture polygon. Points outside the bounding box are
+        rejected first. Convex polygons are tested by which side of each edge the points are on,
+        and other polygons with a crossing number test. Both loop over the edges and test all
+        points for each edge.
+        """
+        xMin, xMax, yMin, yMax = custData["BBox"]
+        isIn  = (xPos >= xMin) & (xPos <= xMax) & (yPos >= yMin) & (yPos <= yMax)
+        inBox = np.flatnonzero(isIn)
+        xPos  = xPos[inBox]
+        yPos  = yPos[inBox]
+
+        if custData["Convex"]:
+            isLeft  = np.ones(len(xPos),dtype="bool")
+            isRight = np.ones(len(xPos),dtype="bool")
+            for xA, yA, xB, yB in custData["Edges"]:
+                pCross   = (xB - xA)*(yPos - yA) - (yB - yA)*(xPos - xA)
+                isLeft  &= pCross >= 0.0
+                isRight &= pCross <= 0.0
+            isIn[inBox] = isLeft | isRight
+            return isIn
+
+        isCross = np.zeros(len(xPos),dtype="bool")
+        for xA, yA, xB, yB in custData["Edges"]:
+            if yA == yB:
+                continue
+            doCross  = (yA > yPos) != (yB > yPos)
+            xCross   = xA + (yPos - yA)*(xB - xA)/(yB - yA)
+            isCross ^= doCross & (xPos < xCross)
+        isIn[inBox] = isCross
+
+        return isIn
 
     #
     # Setters and Getters
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*
+"""Column Cache
+
+  SixTrack Tools - Column Cache
+ ===============================
+  By: Veronica Berglyd Olsen
+      CERN (BE-ABP-HSS)
+      Geneva, Switzerland
+
+  Stores parsed columns of text data files as NumPy .npy files, and loads them back memory mapped.
+
+  By default the cache for a file is written to a hidden .stcache folder next to the file. If a
+  cache folder is given, all files are cached there instead, in subfolders named from a hash of the
+  source path. A cache entry is only used if the size and modification time of the source file are
+  unchanged since it was written, and optionally also the SHA1 hash of its content.
+
+  If a maximum size is set, the least recently used entries in the cache folder are deleted when a
+  new entry is written and the folder grows beyond it. Entries are written under temporary names
+  and moved in place, so several processes can fill the same cache at once.
+
+"""
+
+import logging
+import numpy as np
+import json
+
+from os      import path, stat, makedirs, replace, getpid, listdir, utime, walk
+from shutil  import rmtree
+from hashlib import sha1
+
+logger = logging.getLogger(__name__)
+
+class ColCache:
+
+    CACHE_FOLDER = ".stcache"
+    META_FILE    = "meta.json"
+
+    def __init__(self, cacheDir=None, maxSize=None, useHash=False):
+
+        self.cacheDir = cacheDir
+        self.maxSize  = maxSize
+        self.useHash  = useHash
+
+        if cacheDir is not None and not path.isdir(cacheDir):
+            try:
+                makedirs(cacheDir,exist_ok=True)
+            except OSError:
+                logger.error("Unable to create cache folder: %s" % cacheDir)
+                self.cacheDir = None
+
+        return
+
+    def loadData(self, srcFile, colNames=None):
+        """
+        Returns a dictionary of memory mapped column arrays for srcFile, or None if there is no
+        valid cache entry. If colNames is given, only those columns are loaded. The arrays are
+        mapped copy-on-write, so they can be edited in place without changing the cache.
+        """
+
+        colData, fileInfo = self.loadEntry(srcFile,colNames)
+
+        return colData
+
+    def loadInfo(self, srcFile):
+        """
+        Returns the extra file information saved with the cache entry for srcFile, or None if there
+        is no valid cache entry.
+        """
+
+        metaData = self._loadMeta(srcFile)
+        if metaData is None:
+            return None
+
+        return metaData.get("Info",None)
+
+    def loadEntry(self, srcFile, colNames=None):
+        """
+        Returns both the column arrays and the extra file information for srcFile, validating the
+        cache entry only once. If colNames is None, the column names are taken from the varNames
+        entry of the file information if there is one, and otherwise all columns are loaded.
+        Returns None, None if there is no valid cache entry.
+        """
+
+        metaData = self._loadMeta(srcFile)
+        if metaData is None:
+            return None, None
+
+        fileInfo = metaData.get("Info",None)
+        if colNames is None:
+            if fileInfo is not None and "varNames" in fileInfo:
+                colNames = fileInfo["varNames"]
+            else:
+                colNames = metaData["Columns"]
+
+        entryPath = self._entryPath(srcFile)
+        colData   = {}
+        try:
+            for cN in colNames:
+                if not cN in metaData["Columns"]:
+                    return None, None
+                colData[cN] = np.load(path.join(entryPath,cN+".npy"),mmap_mode="c")
+            utime(path.join(entryPath,self.META_FILE))
+        except (OSError,ValueError):
+            logger.debug("Cache entry for %s was removed while loading" % path.basename(srcFile))
+            return None, None
+
+        logger.info("Loaded %d columns of %s from cache" % (len(colData),path.basename(srcFile)))
+
+        return colData, fileInfo
+
+    def saveData(self, srcFile, colData, fileInfo=None):
+        """
+        Writes a dictionary of column arrays for srcFile to the cache. Each file is first written
+        under a temporary name and then moved in place, and the meta file is written last, so
+        that other processes never see a partially written entry. The optional fileInfo must be
+        serialisable as JSON, and can be read back with loadInfo.
+        """
+
+        entryPath = self._entryPath(srcFile)
+        tmpTag    = ".%d.tmp" % getpid()
+        try:
+            makedirs(entryPath,exist_ok=True)
+            for cN in colData.keys():
+                colPath = path.join(entryPath,cN+".npy")
+                with open(colPath+tmpTag,mode="wb") as colFile:
+                    np.save(colFile,colData[cN])
+                replace(colPath+tmpTag,colPath)
+            metaData = self._fileMeta(srcFile,list(colData.keys()))
+            if fileInfo is not None:
+                metaData["Info"] = fileInfo
+            metaPath = path.join(entryPath,self.META_FILE)
+            with open(metaPath+tmpTag,mode="wt") as metaFile:
+                json.dump(metaData,metaFile)
+            replace(metaPath+tmpTag,metaPath)
+        except OSError as e:
+            logger.warning("Unable to write cache for %s: %s" % (path.basename(srcFile),str(e)))
+            return False
+
+        logger.debug("Wrote %d columns of %s to cache" % (len(colData),path.basename(srcFile)))
+
+        if self.maxSize is not None:
+            self.evictEntries(path.dirname(entryPath),keepEntry=entryPath)
+
+        return True
+
+    def evictEntries(self, cacheRoot, keepEntry=None):
+        """
+        Deletes the least recently used entries in cacheRoot until the total size is below maxSize.
+        The entry keepEntry is never deleted. Entries that disappear while scanning, because
+        another process evicted them, are skipped.
+        """
+
+        if self.maxSize is None or not path.isdir(cacheRoot):
+            return 0
+
+        entryList = []
+        totSize   = 0
+        for entryName in listdir(cacheRoot):
+            entryPath = path.join(cacheRoot,entryName)
+            try:
+                lastUsed  = stat(path.join(entryPath,self.META_FILE)).st_mtime_ns
+                entrySize = self._folderSize(entryPath)
+            except OSError:
+                continue
+            totSize += entrySize
+            if entryPath != keepEntry:
+                entryList.append((lastUsed,entrySize,entryPath))
+
+        nEvict = 0
+        for lastUsed, entrySize, entryPath in sorted(entryList):
+            if totSize <= self.maxSize:
+                break
+            rmtree(entryPath,ignore_errors=True)
+            totSize -= entrySize
+            nEvict  += 1
+
+        if nEvict > 0:
+            logger.debug("Evicted %d cache entries from %s" % (nEvict,cacheRoot))
+
+        return nEvict
+
+    #
+    #  Internal Functions
+    #
+
+    def _entryPath(self, srcFile):
+        srcFile = path.abspath(srcFile)
+        if self.cacheDir is None:
+            return path.join(path.dirname(srcFile),self.CACHE_FOLDER,path.basename(srcFile))
+        pathHash = sha1(srcFile.encode("utf-8")).hexdigest()[:16]
+        return path.join(self.cacheDir,"%s_%s" % (pathHash,path.basename(srcFile)))
+
+    def _loadMeta(self, srcFile):
+        metaPath = path.join(self._entryPath(srcFile),self.META_FILE)
+        if not path.isfile(metaPath):
+            return None
+
+        try:
+            with open(metaPath,mode="rt") as metaFile:
+                metaData = json.load(metaFile)
+        except (OSError,ValueError):
+            logger.warning("Ignoring unreadable cache entry for %s" % path.basename(srcFile))
+            return None
+
+        fileMeta = self._fileMeta(srcFile,metaData["Columns"])
+        for metaKey in fileMeta.keys():
+            if metaData.get(metaKey,None) != fileMeta[metaKey]:
+                logger.debug("Cache entry for %s is outdated" % path.basename(srcFile))
+                return None
+
+        return metaData
+
+    def _fileMeta(self, srcFile, colNames):
+        fStat    = stat(srcFile)
+        metaData = {
+            "Source"  : path.abspath(srcFile),
+            "Size"    : fStat.st_size,
+            "MTime"   : fStat.st_mtime_ns,
+            "Columns" : list(colNames),
+        }
+        if self.useHash:
+            fileHash = sha1()
+            with open(srcFile,mode="rb") as inFile:
+                for fileBlock in iter(lambda: inFile.read(1048576),b""):
+                    fileHash.update(fileBlock)
+            metaData["Hash"] = fileHash.hexdigest()
+        return metaData
+
+    def _folderSize(self, folderPath):
+        totSize = 0
+        for dirPath, dirNames, fileNames in walk(folderPath):
+            for fileName in fileNames:
+                totSize += stat(path.join(dirPath,fileName)).st_size
+        return totSize
+
+# END Class ColCache
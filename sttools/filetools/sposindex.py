@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*
+"""Longitudinal Position Index
+
+  SixTrack Tools - Longitudinal Position Index
+ ==============================================
+  Looks up which lattice element contains a given s position
+  By: Veronica Berglyd Olsen
+      CERN (BE-ABP-HSS)
+      Geneva, Switzerland
+
+  The index is built from the S and L columns of a TableFS object. MadX writes S at the exit of each
+  element, so an element covers the range [S-L, S]. If the table has no L column, each element is
+  assumed to start where the previous one ends. Sliced elements named ELEMENT..k are looked up as
+  their parent element.
+
+  If the table has a LENGTH header, positions are wrapped into the ring, [0, LENGTH), before the
+  lookup, and an element that straddles the start of the sequence after TableFS.shiftSeq is found on
+  both sides of it.
+
+"""
+
+import logging
+import numpy as np
+
+from os import path
+
+logger = logging.getLogger(__name__)
+
+class SPosIndex:
+
+    def __init__(self, tfsData=None, mergeSlices=True):
+
+        self.elemName = np.zeros(0,dtype="str")
+        self.elemRow  = np.zeros(0,dtype="int")
+        self.sBeg     = np.zeros(0,dtype="float")
+        self.sEnd     = np.zeros(0,dtype="float")
+        self.ringLen  = 0.0
+
+        if tfsData is None:
+            return
+
+        if not "S" in tfsData.varNames:
+            logger.error("The table has no S column")
+            return
+
+        sPos = np.asarray(tfsData.Data["S"],dtype="float")
+        if "L" in tfsData.varNames:
+            sLen = np.asarray(tfsData.Data["L"],dtype="float")
+        else:
+            sLen = np.zeros(len(sPos))
+            sLen[1:] = np.maximum(np.diff(sPos),0.0)
+
+        if "LENGTH" in tfsData.metaData.keys():
+            self.ringLen = float(tfsData.metaData["LENGTH"])
+
+        elemName = np.asarray(tfsData.Data["NAME"]).astype("str")
+        if mergeSlices and len(elemName) > 0:
+            nameSplt = np.char.partition(elemName,"..")
+            isSliced = (nameSplt[:,1] == "..") & np.char.isdigit(nameSplt[:,2])
+            elemName = np.where(isSliced,nameSplt[:,0],elemName)
+
+        # Order by exit position, keeping the sequence order for elements at the same position
+        sOrder        = np.argsort(sPos,kind="stable")
+        self.elemName = elemName[sOrder]
+        self.elemRow  = sOrder
+        self.sEnd     = sPos[sOrder]
+        self.sBeg     = self.sEnd - sLen[sOrder]
+
+        logger.info("Built s position index of %d elements" % len(self.sEnd))
+
+        return
+
+    def findRows(self, sPos):
+        """
+        Returns the table row of the element containing each position in sPos, or -1 where no
+        element covers the position. At the boundary between two elements, the upstream element
+        is returned.
+        """
+
+        sPos = np.asarray(sPos,dtype="float")
+        if len(self.sEnd) == 0:
+            return np.full(sPos.shape,-1,dtype="int")
+
+        if self.ringLen > 0.0:
+            sPos = np.mod(sPos,self.ringLen)
+
+        sIdx  = np.searchsorted(self.sEnd,sPos,side="left")
+        isIn  = sIdx < len(self.sEnd)
+        sIdx  = np.minimum(sIdx,len(self.sEnd)-1)
+        isIn &= self.sBeg[sIdx] <= sPos
+
+        # Elements starting before the start of the sequence cover the end of the ring
+        wrapIdx = np.argmin(self.sBeg)
+        if self.sBeg[wrapIdx] < 0.0 and self.ringLen > 0.0:
+            isWrap = ~isIn & (sPos >= self.sBeg[wrapIdx] + self.ringLen)
+            sIdx[isWrap] = wrapIdx
+            isIn |= isWrap
+
+        return np.where(isIn,self.elemRow[sIdx],-1)
+
+    def findNames(self, sPos):
+        """
+        Returns the name of the element containing each position in sPos, or an empty string where
+        no element covers the position.
+        """
+
+        sRows   = self.findRows(sPos)
+        rowName = np.empty(len(self.elemRow),dtype=self.elemName.dtype)
+        rowName[self.elemRow] = self.elemName
+
+        return np.where(sRows >= 0,rowName[sRows],"")
+
+    def save(self, fileName):
+        """
+        Saves the index to a NumPy .npz file.
+        """
+
+        np.savez(
+            fileName,
+            elemName = self.elemName,
+            elemRow  = self.elemRow,
+            sBeg     = self.sBeg,
+            sEnd     = self.sEnd,
+            ringLen  = self.ringLen,
+        )
+
+        return True
+
+    @classmethod
+    def load(cls, fileName):
+        """
+        Loads an index saved with save.
+        """
+
+        if not path.isfile(fileName):
+            logger.error("File not found: %s" % fileName)
+            return None
+
+        theIndex = cls()
+        with np.load(fileName) as npzData:
+            theIndex.elemName = npzData["elemName"]
+            theIndex.elemRow  = npzData["elemRow"]
+            theIndex.sBeg     = npzData["sBeg"]
+            theIndex.sEnd     = npzData["sEnd"]
+            theIndex.ringLen  = float(npzData["ringLen"])
+
+        return theIndex
+
+# END Class SPosIndex
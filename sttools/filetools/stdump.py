@@ -18,24 +18,41 @@ import logging
 import numpy   as np
 import re
 
-from os import path
+from os                 import path
+from copy               import copy
+from zipfile            import ZipFile
+from itertools          import islice
+from concurrent.futures import ProcessPoolExecutor
+
+from sttools.functions  import openFile, fileCompression, filterMask
 
 logger = logging.getLogger(__name__)
 
 class STDump:
 
     HEADER_CHAR = ("#","%","!")
+    DTYPE_MAP   = {"int" : "int", "float" : "float", "str" : "object"}
+    CHUNK_LINES = 1000000
+    RANGE_BYTES = 67108864
 
-    def __init__(self, fileName):
+    def __init__(self, fileName, colCache=None, zipArch=None):
 
-        if path.isfile(fileName):
-            self.validFile = True
+        if zipArch is not None:
+            with ZipFile(zipArch,mode="r") as zFile:
+                self.validFile = fileName in zFile.namelist()
         else:
+            self.validFile = path.isfile(fileName)
+        if not self.validFile:
             logger.error("File not found: %s" % fileName)
-            self.validFile = False
             return
 
+        if zipArch is not None and colCache is not None:
+            logger.debug("Files in zip archives are not cached")
+            colCache = None
+
         self.fileName  = fileName
+        self.zipArch   = zipArch
+        self.colCache  = colCache
         self.metaData  = {}
 
         self.colNames  = []
@@ -58,7 +75,7 @@ class STDump:
 
         headerLines = []
         firstData   = ""
-        with open(self.fileName,mode="rt") as tmpFile:
+        with openFile(self.fileName,"rt",self.zipArch) as tmpFile:
             for tmpLine in tmpFile:
                 tmpLine = tmpLine.lstrip()
                 if len(tmpLine) == 0: continue
@@ -141,8 +158,6 @@ class STDump:
                 makeIdx = True
 
             self.hasIndex[self.colNames[colNum]] = makeIdx
-            if makeIdx:
-                self.idxData[self.colNames[colNum]] = {}
 
             colNum += 1
 
@@ -150,7 +165,8 @@ class STDump:
 
     def addIndex(self, colName):
         """
-        Adds an index for the sepcified column. Must be run before readAll.
+        Allows indexing of the sepcified column. Integer columns are indexable by default.
+        The index itself is only built the first time the column is used in filterPart.
         This function does not check whether it makes sense to index that column.
         For instance, if it's float values, it may generate one index entry per value.
         """
@@ -160,69 +176,102 @@ class STDump:
 
         return
 
-    def readAll(self):
+    def readAll(self, columns=None, filterBy=None, nWorkers=1):
         """
-        Reads all lines that do not start with #
-        Generates an index for all columns with hasIndex = True
+        Reads all lines that do not start with a header character.
+        The data block is parsed in bulk into typed arrays. If that fails, for instance due to an
+        irregular number of columns, the file is parsed again line by line.
+        Any existing index is dropped, and rebuilt on demand by filterPart.
+
+        columns  : Only read these columns. The remaining columns are never converted.
+        filterBy : Only keep rows matching a filter. See sttools.functions.filterMask for the format.
+        nWorkers : Parse the file in parallel in this many processes. Functions in filterBy must
+                   then be picklable, that is, defined at module level.
+
+        When columns or filterBy is set, the file is read in chunks and rejected rows are dropped
+        before they are stored, so allData only holds the requested data.
+
+        If the object has a column cache, the data is loaded from the cache when it is valid, and
+        a full read of the file is written to the cache.
         """
 
-        self.allData = {dKey:[] for dKey in self.colNames}
-        with open(self.fileName,mode="rt") as tmpFile:
+        self.idxData = {}
 
-            lineNo = 0
+        readCols = self._checkColumns(columns,filterBy)
+        if readCols is None:
+            return False
 
-            for tmpLine in tmpFile:
+        if self.colCache is not None and self._readCache(readCols,filterBy):
+            return True
 
-                tmpLine = tmpLine.strip()
-                lineNo += 1
-                if tmpLine[0] in self.HEADER_CHAR: continue
+        isFull = columns is None and filterBy is None
+        if nWorkers > 1 and (self.zipArch is not None or fileCompression(self.fileName) is not None):
+            logger.info("Compressed files cannot be split, parsing in a single process")
+            nWorkers = 1
+        if nWorkers > 1 and path.getsize(self.fileName) > self.RANGE_BYTES:
+            self._joinBlocks(readCols,self._readParallel(readCols,filterBy,nWorkers))
+        elif not isFull:
+            self._joinBlocks(readCols,self._iterBlocks(self.CHUNK_LINES,readCols,filterBy))
+        elif not self._readBulk():
+            logger.warning("Bulk parsing failed, falling back to line by line parsing")
+            self._readLines()
 
-                spLines = tmpLine.split()
-                for (spLine,cN) in zip(spLines,self.colNames):
+        if self.colCache is not None and isFull:
+            self.colCache.saveData(self.fileName,self.allData)
 
-                    if len(spLines) == len(self.colNames):
-                        self.allData[cN].append(spLine)
-                    else:
-                        logger.warning("Line %d has an unexpected number of elements" % lineNo)
+        return True
 
-                    if self.hasIndex[cN]:
-                        dataID = len(self.allData[self.colNames[0]]) -1
-                        self.idxData[cN].setdefault(spLine,[]).append(dataID)
+    def iterChunks(self, nLines=CHUNK_LINES, columns=None, filterBy=None):
+        """
+        Generator that reads the file in chunks of at most nLines lines and yields each chunk as a
+        record array with one field per column. Only one chunk is held in memory at a time, and
+        allData, metaData and colNames are not modified. Lines with an unexpected number of
+        elements are skipped. The columns and filterBy settings are the same as for readAll.
+        """
 
-            self.nLines = len(self.allData[self.colNames[0]])
-            logger.info("%d lines of data read from %s" % (self.nLines,self.fileName))
+        if nLines < 1:
+            logger.error("The chunk size must be at least one line")
+            return
 
-        # Convert columns to numpy arrays
-        for i in range(len(self.colNames)):
-            cN = self.colNames[i]
-            cT = self.colTypes[i]
-            self.allData[cN] = np.asarray(self.allData[cN],dtype=cT)
+        readCols = self._checkColumns(columns,filterBy)
+        if readCols is None:
+            return
+
+        for chunkData in self._iterBlocks(nLines,readCols,filterBy):
+            yield np.rec.fromarrays([chunkData[cN] for cN in readCols],names=readCols)
 
         return
 
     def filterPart(self, colName, colValue):
         """
         Selects all particles with a given column value for a given column name.
-        Entries are copied into filData
+        The value can be a single value, a (minVal, maxVal) tuple for an inclusive range where
+        either limit may be None, or a list or set of values.
+        Entries are copied into filData in file order.
         """
 
-        colName  = str(colName)
-        colValue = str(colValue)
+        colName = str(colName)
         if not colName in self.colNames:
             logger.error("Unknown column name '%s'" % colName)
             return False
 
-        if not colValue in self.idxData[colName].keys():
-            logger.error("Particles with %s = %s do not exist in dataset" % (colName,colValue))
+        if self.allData is None or not colName in self.allData.keys():
+            logger.error("Column '%s' has not been read" % colName)
             return False
 
-        self.filData = None
-        self.filData = {dKey:[] for dKey in self.colNames}
+        if not self.hasIndex[colName]:
+            logger.error("Column '%s' is not indexed, see addIndex" % colName)
+            return False
 
-        for cN in self.colNames:
-            self.filData[cN] = self.allData[cN][self.idxData[colName][colValue]]
+        idxRows = self._lookupIndex(colName,colValue)
+        if len(idxRows) == 0:
+            logger.error("Particles with %s = %s do not exist in dataset" % (colName,str(colValue)))
+            return False
+
+        self.filData = None
+        self.filData = {dKey:self.allData[dKey][idxRows] for dKey in self.allData.keys()}
 
-        logger.info("%d particle with %s = %s were filtered into filData" % (len(self.filData["ID"]),colName,colValue))
+        logger.info("%d particle with %s = %s were filtered into filData" % (len(idxRows),colName,str(colValue)))
 
         return True
 
@@ -230,9 +279,341 @@ class STDump:
     #  Internal Functions
     #
 
+    def _dataType(self, colNames):
+        """
+        Builds a structured dtype for the given columns from the column types detected in
+        __init__. String columns are parsed as Python objects and converted afterwards.
+        """
+        dtList = []
+        for cN in colNames:
+            cT = self.colTypes[self.colNames.index(cN)]
+            dtList.append((cN, self.DTYPE_MAP[cT]))
+        return np.dtype(dtList)
+
+    def _parseBlock(self, srcLines, colNames):
+        """
+        Parses an iterable of lines, or an open file, into a dictionary of typed column arrays.
+        Comment and header lines are skipped. Raises ValueError if the block is irregular.
+        """
+
+        recData = np.loadtxt(
+            srcLines,dtype=self._dataType(colNames),comments=self.HEADER_CHAR,ndmin=1,
+            usecols=[self.colNames.index(cN) for cN in colNames]
+        )
+        colData = {}
+        for cN in colNames:
+            cT = self.colTypes[self.colNames.index(cN)]
+            colData[cN] = np.asarray(recData[cN],dtype=cT)
+
+        return colData
+
+    def _iterBlocks(self, nLines, readCols, filterBy):
+        """
+        Generator that parses the file in chunks of at most nLines lines, applies filterBy and
+        yields a dictionary of typed arrays for each non-empty chunk, holding only readCols.
+        """
+
+        with openFile(self.fileName,"rt",self.zipArch) as tmpFile:
+            while True:
+                chunkLines = list(islice(tmpFile,nLines))
+                if len(chunkLines) == 0:
+                    break
+                chunkData = self._parseChunk(chunkLines,readCols,filterBy)
+                if len(chunkData[readCols[0]]) == 0:
+                    continue
+                yield chunkData
+
+        return
+
+    def _readParallel(self, readCols, filterBy, nWorkers):
+        """
+        Splits the file into byte ranges starting on line boundaries, and parses them in a pool of
+        nWorkers processes. Returns the parsed blocks in file order.
+        """
+
+        fileSize = path.getsize(self.fileName)
+        nRanges  = max(nWorkers,fileSize//self.RANGE_BYTES)
+
+        # Move each split point forward to the start of the next line
+        rangeEdges = [0]
+        with open(self.fileName,mode="rb") as tmpFile:
+            for i in range(1,nRanges):
+                tmpFile.seek(max(i*fileSize//nRanges,rangeEdges[-1]))
+                tmpFile.readline()
+                rangeEdges.append(min(tmpFile.tell(),fileSize))
+        rangeEdges.append(fileSize)
+        rangeEdges = sorted(set(rangeEdges))
+
+        logger.info("Parsing %s in %d ranges with %d workers" % (
+            path.basename(self.fileName),len(rangeEdges)-1,nWorkers
+        ))
+
+        # The workers get a copy of the parser without any loaded data
+        stParser = copy(self)
+        stParser.allData = None
+        stParser.filData = None
+        stParser.idxData = {}
+
+        with ProcessPoolExecutor(max_workers=nWorkers) as theExec:
+            theBlocks = list(theExec.map(
+                _parseRange,
+                [stParser]*(len(rangeEdges)-1),
+                rangeEdges[:-1],
+                rangeEdges[1:],
+                [readCols]*(len(rangeEdges)-1),
+                [filterBy]*(len(rangeEdges)-1),
+            ))
+
+        return theBlocks
+
+    def _parseChunk(self, chunkLines, readCols, filterBy):
+        """
+        Parses a list of lines, applies filterBy and returns a dictionary of typed arrays holding
+        only readCols. Lines with an unexpected number of elements are skipped.
+        """
+
+        if filterBy is None:
+            filterBy = {}
+
+        # Filter columns are parsed as well, but dropped after the rows are selected
+        parseCols = [cN for cN in self.colNames if cN in readCols or cN in filterBy.keys()]
+
+        try:
+            chunkData = self._parseBlock(chunkLines,parseCols)
+        except ValueError:
+            logger.warning("Irregular lines in chunk, skipping lines that don't match the header")
+            chunkData = self._parseBlock(self._regularLines(chunkLines),parseCols)
+
+        if len(filterBy) > 0:
+            rowMask = self._filterMask(chunkData,filterBy)
+            chunkData = {cN:chunkData[cN][rowMask] for cN in readCols}
+
+        return chunkData
+
+    def _joinBlocks(self, readCols, theBlocks):
+        """
+        Concatenates parsed blocks of data into allData.
+        """
+
+        colBlocks = {cN:[] for cN in readCols}
+        for blockData in theBlocks:
+            for cN in readCols:
+                colBlocks[cN].append(blockData[cN])
+
+        self.allData = {}
+        for cN in readCols:
+            cT = self.colTypes[self.colNames.index(cN)]
+            if len(colBlocks[cN]) > 0:
+                self.allData[cN] = np.concatenate(colBlocks[cN])
+            else:
+                self.allData[cN] = np.asarray([],dtype=cT)
+
+        self.nLines = len(self.allData[readCols[0]])
+        logger.info("%d lines of data read from %s" % (self.nLines,self.fileName))
+
+        return
+
+    def _checkColumns(self, columns, filterBy):
+        """
+        Checks the requested column names and filter keys, and returns the columns to read in
+        file order. Returns None if any of the names are unknown.
+        """
+
+        if columns is None:
+            columns = self.colNames
+        if filterBy is None:
+            filterBy = {}
+
+        for cN in list(columns) + list(filterBy.keys()):
+            if not cN in self.colNames:
+                logger.error("Unknown column name '%s'" % cN)
+                return None
+
+        readCols = [cN for cN in self.colNames if cN in columns]
+        if len(readCols) == 0:
+            logger.error("No columns selected")
+            return None
+
+        return readCols
+
+    def _filterMask(self, colData, filterBy):
+        """
+        Evaluates a row filter on a dictionary of column arrays and returns a boolean mask.
+        See sttools.functions.filterMask for the format of the filter.
+        """
+        return filterMask(colData, filterBy)
+
+    def _regularLines(self, srcLines):
+        """
+        Returns the lines that have the expected number of elements, and skips the rest.
+        """
+
+        nCols   = len(self.colNames)
+        goLines = []
+        for srcLine in srcLines:
+            spLine = srcLine.split()
+            if len(spLine) == 0 or spLine[0][0] in self.HEADER_CHAR or len(spLine) == nCols:
+                goLines.append(srcLine)
+            else:
+                logger.warning("Skipping line with an unexpected number of elements")
+
+        return goLines
+
+    def _readCache(self, readCols, filterBy):
+        """
+        Loads the requested columns from the column cache and applies filterBy.
+        Returns False if the cache has no valid entry for the file.
+        """
+
+        if filterBy is None:
+            filterBy = {}
+
+        loadCols = [cN for cN in self.colNames if cN in readCols or cN in filterBy.keys()]
+        colData  = self.colCache.loadData(self.fileName,loadCols)
+        if colData is None:
+            return False
+
+        if len(filterBy) > 0:
+            rowMask = self._filterMask(colData,filterBy)
+            colData = {cN:colData[cN][rowMask] for cN in readCols}
+
+        self.allData = colData
+        self.nLines  = len(self.allData[readCols[0]])
+
+        return True
+
+    def _readBulk(self):
+        """
+        Parses the data block in a single pass with numpy's C parser.
+        Returns False if the file could not be parsed this way.
+        """
+
+        try:
+            with openFile(self.fileName,"rt",self.zipArch) as tmpFile:
+                self.allData = self._parseBlock(tmpFile,self.colNames)
+        except ValueError as e:
+            logger.debug("Bulk parser error: %s" % str(e))
+            return False
+
+        self.nLines = len(self.allData[self.colNames[0]])
+        logger.info("%d lines of data read from %s" % (self.nLines,self.fileName))
+
+        return True
+
+    def _getIndex(self, colName):
+        """
+        Returns the index of a column, building it first if necessary. The index is the stable
+        sort order of the column, the unique values, and the offsets into the sort order where
+        each unique value starts, with one extra element holding the total number of rows.
+        """
+
+        if colName in self.idxData.keys():
+            return self.idxData[colName]
+
+        colData = self.allData[colName]
+        idxOrd  = np.argsort(colData,kind="stable")
+        srtData = colData[idxOrd]
+        idxNew  = np.flatnonzero(srtData[1:] != srtData[:-1]) + 1
+        idxOff  = np.concatenate(([0],idxNew,[len(colData)]))
+
+        self.idxData[colName] = {
+            "Order"  : idxOrd,
+            "Values" : srtData[idxOff[:-1]],
+            "Offset" : idxOff,
+        }
+        logger.debug("Built index for column '%s' with %d unique values" % (colName,len(idxOff)-1))
+
+        return self.idxData[colName]
+
+    def _lookupIndex(self, colName, colValue):
+        """
+        Returns the row numbers, in file order, where the column matches colValue. See filterPart
+        for the accepted values.
+        """
+
+        theIdx = self._getIndex(colName)
+        idxOrd = theIdx["Order"]
+        idxVal = theIdx["Values"]
+        idxOff = theIdx["Offset"]
+
+        valType = self.allData[colName].dtype
+        if valType.kind == "U":
+            valType = "str"
+
+        if isinstance(colValue,tuple):
+            # An inclusive range of values is a single slice of the sort order
+            valMin, valMax = colValue
+            iMin = 0 if valMin is None else np.searchsorted(idxVal,valMin,side="left")
+            iMax = len(idxVal) if valMax is None else np.searchsorted(idxVal,valMax,side="right")
+            return np.sort(idxOrd[idxOff[iMin]:idxOff[max(iMin,iMax)]])
+
+        if isinstance(colValue,(list,set,frozenset,np.ndarray)):
+            # A set of values is gathered from several slices of the sort order
+            theVals = np.unique(np.asarray(list(colValue),dtype=valType))
+            valPos  = np.searchsorted(idxVal,theVals)
+            isFound = valPos < len(idxVal)
+            isFound[isFound] = idxVal[valPos[isFound]] == theVals[isFound]
+            valPos  = valPos[isFound]
+            posBeg  = idxOff[valPos]
+            posLen  = idxOff[valPos+1] - posBeg
+            posIdx  = np.repeat(posBeg - np.cumsum(posLen) + posLen,posLen) + np.arange(posLen.sum())
+            return np.sort(idxOrd[posIdx])
+
+        # A single value is a slice of the sort order, already in file order
+        theVal = np.asarray(colValue,dtype=valType)
+        valPos = np.searchsorted(idxVal,theVal)
+        if valPos < len(idxVal) and idxVal[valPos] == theVal:
+            return idxOrd[idxOff[valPos]:idxOff[valPos+1]]
+
+        return idxOrd[0:0]
+
+    def _readLines(self):
+        """
+        Reads the file line by line. This is slow, but tolerates irregular lines.
+        """
+
+        self.allData = {dKey:[] for dKey in self.colNames}
+        with openFile(self.fileName,"rt",self.zipArch) as tmpFile:
+
+            lineNo = 0
+
+            for tmpLine in tmpFile:
+
+                tmpLine = tmpLine.strip()
+                lineNo += 1
+                if tmpLine[0] in self.HEADER_CHAR: continue
+
+                spLines = tmpLine.split()
+                for (spLine,cN) in zip(spLines,self.colNames):
+
+                    if len(spLines) == len(self.colNames):
+                        self.allData[cN].append(spLine)
+                    else:
+                        logger.warning("Line %d has an unexpected number of elements" % lineNo)
+
+            self.nLines = len(self.allData[self.colNames[0]])
+            logger.info("%d lines of data read from %s" % (self.nLines,self.fileName))
+
+        # Convert columns to numpy arrays
+        for i in range(len(self.colNames)):
+            cN = self.colNames[i]
+            cT = self.colTypes[i]
+            self.allData[cN] = np.asarray(self.allData[cN],dtype=cT)
+
+        return
+
     def stripQuotes(self, sVar):
         if (sVar[0] == sVar[-1]) and sVar.startswith(("'",'"')):
             return sVar[1:-1]
         return sVar
 
 ## End Class TableFS
+
+def _parseRange(stParser, rangeBeg, rangeEnd, readCols, filterBy):
+    """Worker function for STDump parallel parsing. Parses the lines between two byte positions
+    of the file. The positions must be on line boundaries.
+    """
+    with open(stParser.fileName,mode="rb") as tmpFile:
+        tmpFile.seek(rangeBeg)
+        rangeLines = tmpFile.read(rangeEnd-rangeBeg).decode("utf-8").splitlines()
+    return stParser._parseChunk(rangeLines,readCols,filterBy)
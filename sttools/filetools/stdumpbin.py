@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*
+"""Binary Dump File Wrapper
+
+  SixTrack Tools - Binary Dump File Wrapper
+ ===========================================
+  By: Veronica Berglyd Olsen
+      CERN (BE-ABP-HSS)
+      Geneva, Switzerland
+
+  Maps binary SixTrack dump files onto Numpy record arrays
+
+  The binary DUMP formats are written as Fortran unformatted sequential records, one record per
+  particle per dump. Each record is wrapped in 4 byte little endian record length markers, so the
+  whole file can be memory mapped as one structured array without any parsing.
+
+  Supported formats:
+    3 : Same columns as DUMP format #2, but binary
+    8 : Normalised coordinates, binary
+
+"""
+
+import logging
+import numpy as np
+
+from os                       import path
+from sttools.filetools.stdump import STDump
+
+logger = logging.getLogger(__name__)
+
+class STDumpBin(STDump):
+
+    MARK_TYPE = "<i4"
+
+    # Columns and types of each format, excluding the record markers
+    FORMATS = {
+        3 : [
+            ("ID","<i4"),("TURN","<i4"),("S","<f8"),
+            ("X","<f8"),("XP","<f8"),("Y","<f8"),("YP","<f8"),("Z","<f8"),("DEE","<f8"),
+            ("KTRACK","<i4"),
+        ],
+        8 : [
+            ("ID","<i4"),("TURN","<i4"),("S","<f8"),
+            ("NX","<f8"),("NXP","<f8"),("NY","<f8"),("NYP","<f8"),("NSIG","<f8"),("NDEE","<f8"),
+            ("KTRACK","<i4"),
+        ],
+    }
+
+    def __init__(self, fileName, dumpFormat=3, bezName=None):
+
+        if path.isfile(fileName):
+            self.validFile = True
+        else:
+            logger.error("File not found: %s" % fileName)
+            self.validFile = False
+            return
+
+        if not dumpFormat in self.FORMATS.keys():
+            logger.error("Unsupported binary dump format %s" % str(dumpFormat))
+            self.validFile = False
+            return
+
+        self.fileName   = fileName
+        self.dumpFormat = dumpFormat
+        self.zipArch    = None
+        self.colCache   = None
+        self.metaData   = {"FORMAT" : "DUMP format #%d" % dumpFormat}
+        if bezName is not None:
+            self.metaData["BEZ"] = bezName
+
+        self.colNames  = []
+        self.colTypes  = []
+        for dtName, dtType in self.FORMATS[dumpFormat]:
+            self.colNames.append(dtName)
+            self.colTypes.append("int" if np.dtype(dtType).kind == "i" else "float")
+        self.colLabels = self.colNames.copy()
+
+        self.idxData   = {}
+        self.idxNames  = []
+        self.hasIndex  = {cN:(cT == "int") for cN, cT in zip(self.colNames,self.colTypes)}
+
+        self.allData   = None
+        self.filData   = None
+        self.nLines    = 0
+        self.isNumPy   = True
+        self.hasHeader = False
+        self.recData   = None
+
+        # Map the file
+        recType  = self._recordType()
+        fileSize = path.getsize(fileName)
+        if fileSize % recType.itemsize != 0:
+            logger.error("File size of %s does not match binary dump format %d" % (
+                path.basename(fileName),dumpFormat
+            ))
+            self.validFile = False
+            return
+
+        if fileSize > 0:
+            self.recData = np.memmap(fileName,dtype=recType,mode="r")
+        else:
+            self.recData = np.zeros(0,dtype=recType)
+
+        recSize = recType.itemsize - 2*np.dtype(self.MARK_TYPE).itemsize
+        if not ((self.recData["RECL_A"] == recSize).all() and (self.recData["RECL_B"] == recSize).all()):
+            logger.error("Invalid record markers in %s" % path.basename(fileName))
+            self.validFile = False
+            return
+
+        logger.info("Found %d records in binary dump file %s" % (len(self.recData),path.basename(fileName)))
+
+        return
+
+    @classmethod
+    def isBinary(cls, fileName):
+        """
+        Checks whether the size and the first record markers of a file fit one of the binary dump
+        formats. Several formats share the same record layout, so the format itself cannot be
+        detected, and must be given when the file is opened.
+        """
+
+        if not path.isfile(fileName):
+            return False
+
+        markSize = np.dtype(cls.MARK_TYPE).itemsize
+        fileSize = path.getsize(fileName)
+        for dtList in cls.FORMATS.values():
+            recSize = np.dtype(dtList).itemsize
+            if fileSize == 0 or fileSize % (recSize + 2*markSize) != 0:
+                continue
+            with open(fileName,mode="rb") as binFile:
+                recMark = np.frombuffer(binFile.read(markSize),dtype=cls.MARK_TYPE)
+                binFile.seek(recSize + markSize)
+                endMark = np.frombuffer(binFile.read(markSize),dtype=cls.MARK_TYPE,count=1)
+            if recMark[0] == recSize and endMark[0] == recSize:
+                return True
+
+        return False
+
+    def readAll(self, columns=None, filterBy=None, nWorkers=1):
+        """
+        Maps the columns of the file into allData. The arrays are views of the memory mapped file,
+        unless filterBy is set, in which case the selected rows are copied.
+        The nWorkers setting has no effect, as there is nothing to parse.
+        """
+
+        if not self.validFile:
+            logger.error("No valid file loaded")
+            return False
+
+        self.idxData = {}
+
+        readCols = self._checkColumns(columns,filterBy)
+        if readCols is None:
+            return False
+
+        self.allData = self._selectRecords(self.recData,readCols,filterBy)
+        self.nLines  = len(self.allData[readCols[0]])
+        logger.info("%d records mapped from %s" % (self.nLines,self.fileName))
+
+        return True
+
+    def iterChunks(self, nLines=STDump.CHUNK_LINES, columns=None, filterBy=None):
+        """
+        Generator that yields the file in record arrays of at most nLines records.
+        """
+
+        if not self.validFile:
+            logger.error("No valid file loaded")
+            return
+
+        if nLines < 1:
+            logger.error("The chunk size must be at least one line")
+            return
+
+        readCols = self._checkColumns(columns,filterBy)
+        if readCols is None:
+            return
+
+        for recBeg in range(0,len(self.recData),nLines):
+            chunkData = self._selectRecords(self.recData[recBeg:recBeg+nLines],readCols,filterBy)
+            if len(chunkData[readCols[0]]) == 0:
+                continue
+            yield np.rec.fromarrays([chunkData[cN] for cN in readCols],names=readCols)
+
+        return
+
+    #
+    #  Internal Functions
+    #
+
+    def _recordType(self):
+        return np.dtype(
+            [("RECL_A",self.MARK_TYPE)] + self.FORMATS[self.dumpFormat] + [("RECL_B",self.MARK_TYPE)]
+        )
+
+    def _selectRecords(self, recData, readCols, filterBy):
+        colData = {cN:recData[cN] for cN in readCols}
+        if filterBy is not None and len(filterBy) > 0:
+            rowMask = self._filterMask({cN:recData[cN] for cN in filterBy.keys()},filterBy)
+            colData = {cN:colData[cN][rowMask] for cN in readCols}
+        return colData
+
+## End Class STDumpBin
@@ -16,9 +16,13 @@
 
 import logging
 import numpy   as np
+import fnmatch
 import re
 
-from os import path
+from os                import path
+from copy              import copy
+from itertools         import chain
+from sttools.functions import openFile
 
 logger = logging.getLogger(__name__)
 
@@ -32,10 +36,14 @@ class TableFS:
     
     nLines    = None
     sliceElem = None
+    nameIndex = None
+    seqData   = None
+    seqShift  = 0
     
-    def __init__(self, fileName):
+    def __init__(self, fileName, colCache=None):
         
         self.fileName   = fileName
+        self.colCache   = colCache
         self.metaData   = {}
         self.metaTypes  = {}
         self.varNames   = []
@@ -46,8 +54,15 @@ class TableFS:
         
         self.fileLoaded = False
         
-        # Read File
-        with open(fileName,'r') as tfsFile:
+        # Use the cached columns if the file has not changed
+        if self._readCache():
+            logger.info("%d lines of data loaded from cache" % self.nLines)
+            self.fileLoaded = True
+            return
+        
+        # Read the header, and parse the data block in bulk from the first data line
+        firstLine = None
+        with openFile(fileName,'rt') as tfsFile:
             
             for tfsLine in tfsFile:
                 
@@ -82,37 +97,33 @@ class TableFS:
                 
                 # Data
                 else:
-                    spLines = tfsLine.split()
-                    assert len(spLines) == len(self.varNames)
-                    for (spLine,vN,vT) in zip(spLines,self.varNames,self.varTypes):
-                        self.Data[vN].append(spLine)
-                        if vT == "%s":
-                            self.Data[vN][-1] = self.stripQuotes(self.Data[vN][-1])
-                    self.nLines += 1
-                
-            logger.info("%d lines of data read" % self.nLines)
-        
-        # Converting arrays to Numpy
-        for i in range(len(self.varNames)):
-            
-            vN = self.varNames[i]
-            vT = self.varTypes[i]
+                    firstLine = tfsLine
+                    break
             
-            if   vT[-1] == "d":
-                self.Data[vN] = np.asarray(self.Data[vN],dtype="int")
-            elif vT[-1] == "e":
-                self.Data[vN] = np.asarray(self.Data[vN],dtype="float")
-            elif vT[-1] == "s":
-                self.Data[vN] = np.asarray(self.Data[vN],dtype="str")
-            else:
-                logger.error("Unknown type '%s' for variable '%s'" % (vT, vN))
+            tfsType = self._dataType()
+            if tfsType is None:
                 return
             
+            if firstLine is None:
+                self.Data = {vN:np.zeros(0,dtype=tfsType[vN]) for vN in self.varNames}
+            elif not self._readBulk(chain([firstLine],tfsFile),tfsType):
+                self._readLines()
+            
+        logger.info("%d lines of data read" % self.nLines)
+        
         if self.nLines == len(self.Data["NAME"]):
             self.fileLoaded = True
         else:
             logger.error("")
         
+        if self.fileLoaded and self.colCache is not None:
+            self.colCache.saveData(self.fileName,self.Data,{
+                "metaData"  : self.metaData,
+                "metaTypes" : self.metaTypes,
+                "varNames"  : self.varNames,
+                "varTypes"  : self.varTypes,
+            })
+        
         return
     
     def fileInfo(self):
@@ -158,106 +169,396 @@ class TableFS:
         
         return
         
+    def save(self, fileName, columns=None):
+        """
+        Writes the table to a TFS file. Each column is formatted as a whole and the file is written
+        in a single write. Floats are written with 17 significant digits, so that parsing the file
+        gives back identical data. If columns is set, only those columns are written, in that order.
+        Files with a .gz, .bz2, .xz or .zst extension are compressed.
+        """
+        
+        if not self.fileLoaded:
+            logger.error("No TFS file loaded")
+            return False
+        
+        if columns is None:
+            columns = self.varNames
+        for vN in columns:
+            if not vN in self.varNames:
+                logger.error("Unknown column '%s'" % vN)
+                return False
+        
+        # Metadata
+        tfsLines = []
+        for metaName in self.metaData.keys():
+            metaVal = self.metaData[metaName]
+            if   self.metaTypes[metaName] == "int":
+                tfsLines.append("@ %-16s %-5s %d" % (metaName,"%d",metaVal))
+            elif self.metaTypes[metaName] == "float":
+                tfsLines.append("@ %-16s %-5s %23.16e" % (metaName,"%le",metaVal))
+            elif self.metaTypes[metaName] == "str":
+                tfsLines.append("@ %-16s %-5s \"%s\"" % (metaName,"%%%02ds" % len(metaVal),metaVal))
+        
+        # Columns
+        colText  = []
+        colHeads = []
+        colTypes = []
+        for vN in columns:
+            vT = self.varTypes[self.varNames.index(vN)]
+            if   vT[-1] == "d":
+                colStr = np.char.mod("%d",np.asarray(self.Data[vN]))
+            elif vT[-1] == "e":
+                colStr = np.char.mod("%.16e",np.asarray(self.Data[vN]))
+            else:
+                colStr = np.char.add(np.char.add('"',np.asarray(self.Data[vN]).astype("str")),'"')
+            colWidth = max(len(vN),len(vT),np.char.str_len(colStr).max() if self.nLines > 0 else 0)
+            if vT[-1] == "s":
+                colText.append(np.char.ljust(colStr,colWidth))
+                colHeads.append(vN.ljust(colWidth))
+                colTypes.append(vT.ljust(colWidth))
+            else:
+                colText.append(np.char.rjust(colStr,colWidth))
+                colHeads.append(vN.rjust(colWidth))
+                colTypes.append(vT.rjust(colWidth))
+        
+        tfsLines.append(("* " + " ".join(colHeads)).rstrip())
+        tfsLines.append(("$ " + " ".join(colTypes)).rstrip())
+        
+        if self.nLines > 0:
+            rowText = np.full(self.nLines," ",dtype="U1")
+            for c, cT in enumerate(colText):
+                rowText = np.char.add(rowText,cT if c == 0 else np.char.add(" ",cT))
+            tfsLines += np.char.rstrip(rowText).tolist()
+        
+        with openFile(fileName,"wt") as tfsFile:
+            tfsFile.write("\n".join(tfsLines) + "\n")
+        
+        logger.info("Wrote %d lines of data to %s" % (self.nLines,path.basename(fileName)))
+        
+        return True
+    
     def slicedRebuild(self, maxSearch=None):
         """
-        Rebuild sliced elements
+        Rebuild sliced elements. Slices named ELEMENT..k are grouped by element name in a single
+        pass, and stored in sliceElem as arrays of element name, first and last S position, and
+        first and last row, ordered by first row. If maxSearch is set, only slices within maxSearch
+        rows of the first slice are included.
         """
         
         logger.info("Rebuilding sliced elements.")
         
-        currElementName  = None
-        currElementStart = None
-        currElementEnd   = None
-        self.sliceElem   = {}
-        
-        for i in range(self.nLines):
-            
-            # Look for sliced element
-            
-            name1 = self.Data["NAME"][i]
-            ns1   = name1.split("..")
-            
-            if len(ns1) == 2:
-                if not ns1[0] in self.elements:
-                    idx = int(ns1[1])
-                    if idx != 1:
-                        logger.warn("Starting in the middle of a sliced element\t Element name = '%s'\t First idx = %d" % (ns1[0], idx))
-                    
-                    sMin = float(self.Data["S"][i])
-                    sMax = float(self.Data["S"][i])
-                    maxJ = self.nLines
-                    
-                    if maxSearch != None:
-                        maxJ = min(self.nLines,i+1+maxSearch)
-                    
-                    for j in range(i+1, maxJ):
-                        name2 = self.Data["NAME"][j]
-                        ns2   = name2.split("..")
-                        if len(ns2)==2:
-                            if ns2[0] == ns1[0]:
-                                idx += 1
-                                assert idx == int(ns2[1])
-                                sMax = float(self.Data["S"][j])
-                    
-                    self.sliceElem[ns1[0]] = (sMin,sMax)
+        nameData = self.Data["NAME"]
+        sRows    = np.flatnonzero(np.char.count(nameData,"..") == 1)
+        nameSplt = np.char.partition(nameData[sRows],"..")
+        isNum    = np.char.isdigit(nameSplt[:,2])
+        sRows    = sRows[isNum]
+        sBase    = nameSplt[isNum,0]
+        sIdx     = nameSplt[isNum,2].astype("int")
+        
+        elemName, firstPos, elemInv = np.unique(sBase,return_index=True,return_inverse=True)
+        firstRow = sRows[firstPos]
+        firstIdx = sIdx[firstPos]
+        
+        if maxSearch is not None:
+            inRange = sRows <= firstRow[elemInv] + maxSearch
+            sRows   = sRows[inRange]
+            sIdx    = sIdx[inRange]
+            elemInv = elemInv[inRange]
+        
+        lastRow = firstRow.copy()
+        np.maximum.at(lastRow,elemInv,sRows)
+        
+        for eN, eIdx in zip(elemName[firstIdx != 1],firstIdx[firstIdx != 1]):
+            logger.warning("Starting in the middle of a sliced element\t Element name = '%s'\t First idx = %d" % (eN, eIdx))
+        
+        # Slices of each element must be numbered consecutively
+        grpOrder = np.argsort(elemInv,kind="stable")
+        isNext   = elemInv[grpOrder][1:] == elemInv[grpOrder][:-1]
+        nBroken  = np.count_nonzero(isNext & (np.diff(sIdx[grpOrder]) != 1))
+        if nBroken > 0:
+            logger.warning("Found %d slices out of sequence" % nBroken)
+        
+        elemOrder = np.argsort(firstRow,kind="stable")
+        self.sliceElem = {
+            "NAME"  : elemName[elemOrder],
+            "SMIN"  : self.Data["S"][firstRow[elemOrder]].astype("float"),
+            "SMAX"  : self.Data["S"][lastRow[elemOrder]].astype("float"),
+            "FIRST" : firstRow[elemOrder],
+            "LAST"  : lastRow[elemOrder],
+        }
         
         return True
+    
+    def findElement(self, elemName):
+        """
+        Returns the rows where the NAME column equals elemName, using a hash index of all names
+        that is built on first use.
+        """
         
+        if self.nameIndex is None:
+            uNames, uInv = np.unique(self.Data["NAME"],return_inverse=True)
+            rowOrder = np.argsort(uInv,kind="stable")
+            rowSplit = np.cumsum(np.bincount(uInv,minlength=len(uNames)))[:-1]
+            self.nameIndex = dict(zip(uNames.tolist(),np.split(rowOrder,rowSplit)))
+        
+        return self.nameIndex.get(elemName,np.zeros(0,dtype="int"))
+    
     def shiftSeq(self, newFirst):
         """
         Shift the sequence such that the element newFirst is the first in the sequence.
+        On the first shift, the columns are copied once into ring buffers holding the table twice,
+        and every shift after that moves the start of a view into the buffers. Before moving, the
+        half of the buffers outside the view is refreshed from it, so changes made to Data are kept
+        across shifts. The S column is not buffered, but re-zeroed from its current values.
         """
         
         # Find the index of the first element:
-        idx = -1
-        for (i,name) in zip(range(self.nLines),self.Data["NAME"]):
-            if name == newFirst:
-                idx = i
-                break
-        if idx==-1:
+        firstIdx = np.flatnonzero(self.Data["NAME"] == newFirst)
+        if len(firstIdx) == 0:
             logger.warn("No element named '%s' found" % newFirst)
             return False
         
-        # Shift all the data arrays
-        for d in self.Data:
-            self.Data[d] = np.roll(self.Data[d],-idx)
+        self._ringBuffers()
+        self._syncRing()
+        shiftIdx      = int(firstIdx[0])
+        self.seqShift = (self.seqShift + shiftIdx) % self.nLines
         
-        # Rezero S
-        s0 = self.Data["S"][0]
-        L  = self.metaData["LENGTH"]
+        # Move all the data views
+        seqBeg = self.seqShift
+        seqEnd = self.seqShift + self.nLines
+        for vN in self.seqData.keys():
+            self.Data[vN] = self.seqData[vN][seqBeg:seqEnd]
         
-        for i in range(self.nLines):
-            self.Data["S"][i] -= s0
-            if self.Data["S"][i] < 0:
-                self.Data["S"][i] += self.metaData["LENGTH"]
+        # Rezero S
+        sData = self.Data["S"]
+        sData = np.concatenate((sData[shiftIdx:],sData[:shiftIdx])) - sData[shiftIdx]
+        sData[sData < 0] += self.metaData["LENGTH"]
         
-        if self.Data["S"][-1] == 0.0:
+        if sData[-1] == 0.0:
             logger.warn("Shifting last element from 0.0 to %d" % self.metaData["LENGTH"])
-            self.Data["S"][-1] = self.metaData["LENGTH"]
+            sData[-1] = self.metaData["LENGTH"]
+        self.Data["S"] = sData
         
-        # Kill elements array which is no longer valid
+        # Kill elements array and name index which are no longer valid
         self.sliceElem = None
+        self.nameIndex = None
         
         return True
+    
+    def view(self, rowStart, rowStop):
+        """
+        Returns a TableFS object with the rows from rowStart up to, but not including, rowStop.
+        The columns are views of this table's columns, so they share memory with it. If rowStop is
+        smaller than rowStart, the range wraps around the end of the sequence. The columns are then
+        read-only views of the ring buffers if the sequence has been shifted, and copies otherwise.
+        The S column of a wrapping view is always a copy, as it is recomputed on every shift.
+        """
+        
+        if not self.fileLoaded:
+            logger.error("No TFS file loaded")
+            return None
+        
+        if rowStart < 0 or rowStop < 0 or rowStart > self.nLines or rowStop > self.nLines:
+            logger.error("Row range %d:%d is outside the table" % (rowStart, rowStop))
+            return None
+        
+        theView           = copy(self)
+        theView.metaData  = dict(self.metaData)
+        theView.metaTypes = dict(self.metaTypes)
+        theView.varNames  = list(self.varNames)
+        theView.varTypes  = list(self.varTypes)
+        theView.sliceElem = None
+        theView.nameIndex = None
+        theView.seqData   = None
+        theView.seqShift  = 0
+        
+        if rowStart <= rowStop:
+            theView.Data = {vN:self.Data[vN][rowStart:rowStop] for vN in self.varNames}
+        elif self.seqData is not None:
+            # Part of the view lies outside the table's own view of the buffers, so refresh it,
+            # and make the view read-only as later refreshes would overwrite changes made to it
+            self._syncRing()
+            seqBeg = (self.seqShift + rowStart) % self.nLines
+            seqEnd = seqBeg + self.nLines - rowStart + rowStop
+            theView.Data = {}
+            for vN in self.seqData.keys():
+                theView.Data[vN] = self.seqData[vN][seqBeg:seqEnd]
+                theView.Data[vN].flags.writeable = False
+            theView.Data["S"] = np.concatenate((self.Data["S"][rowStart:],self.Data["S"][:rowStop]))
+        else:
+            theView.Data = {
+                vN:np.concatenate((self.Data[vN][rowStart:],self.Data[vN][:rowStop])) for vN in self.varNames
+            }
+        
+        theView.nLines = len(theView.Data[self.varNames[0]]) if len(self.varNames) > 0 else 0
         
-    def findDataIndex(self, columnName, searchPattern):
+        return theView
+    
+    def findDataIndex(self, columnName, searchPattern, isGlob=False):
         """
-        Search a data column for a specific pattern
+        Search a data column for a specific pattern. The pattern is a regular expression matched
+        at the start of each value, or a shell style pattern matched against the whole value if
+        isGlob is True. Each distinct value in the column is only matched once.
         """
         
-        retVal = []
+        colData = np.asarray(self.Data[columnName]).astype("str")
+        if len(colData) == 0:
+            return []
         
-        for i in range(self.nLines):
-            if re.match(searchPattern,self.Data[columnName][i]):
-                retVal.append(i)
+        if isGlob:
+            srchExp = re.compile(fnmatch.translate(searchPattern))
+        else:
+            srchExp = re.compile(searchPattern)
         
-        return retVal
+        uValues, uInv = np.unique(colData,return_inverse=True)
+        isMatch = np.fromiter((srchExp.match(uVal) is not None for uVal in uValues.tolist()),dtype="bool")
         
+        return np.flatnonzero(isMatch[uInv.ravel()]).tolist()
+    
     #
     # Internal Functions
     #
     
+    def _ringBuffers(self):
+        """
+        Copies each column, except S, into a buffer holding the table twice, so that any rotation
+        of the sequence is a contiguous view.
+        """
+        
+        if self.seqData is not None:
+            return
+        
+        self.seqData  = {}
+        self.seqShift = 0
+        for vN in self.varNames:
+            if vN == "S":
+                continue
+            self.seqData[vN] = np.concatenate((self.Data[vN],self.Data[vN]))
+            self.Data[vN]    = self.seqData[vN][:self.nLines]
+        
+        return
+    
+    def _syncRing(self):
+        """
+        Copies the rows of the current view into the other half of the ring buffers, so that both
+        copies of the table are equal.
+        """
+        
+        seqBeg = self.seqShift
+        nLines = self.nLines
+        for vN in self.seqData.keys():
+            self.seqData[vN][seqBeg+nLines:] = self.seqData[vN][seqBeg:nLines]
+            self.seqData[vN][:seqBeg]        = self.seqData[vN][nLines:nLines+seqBeg]
+        
+        return
+    
+    def _dataType(self):
+        """
+        Builds the structured dtype of a data line from the $ type line. String columns are parsed
+        as objects, and converted to fixed width strings when the quotes are stripped.
+        """
+        
+        dtList = []
+        for (vN,vT) in zip(self.varNames,self.varTypes):
+            if   vT[-1] == "d":
+                dtList.append((vN,"int"))
+            elif vT[-1] == "e":
+                dtList.append((vN,"float"))
+            elif vT[-1] == "s":
+                dtList.append((vN,"object"))
+            else:
+                logger.error("Unknown type '%s' for variable '%s'" % (vT, vN))
+                return None
+        
+        return np.dtype(dtList)
+    
+    def _readCache(self):
+        """
+        Loads the header and memory mapped columns from the column cache, if there is a valid
+        cache entry for the file. The columns are copy-on-write, so they can be edited in place.
+        """
+        
+        if self.colCache is None:
+            return False
+        
+        colData, fileInfo = self.colCache.loadEntry(self.fileName)
+        if colData is None or fileInfo is None:
+            return False
+        
+        self.metaData  = fileInfo["metaData"]
+        self.metaTypes = fileInfo["metaTypes"]
+        self.varNames  = fileInfo["varNames"]
+        self.varTypes  = fileInfo["varTypes"]
+        self.Data      = colData
+        self.nLines    = len(colData[self.varNames[0]]) if len(self.varNames) > 0 else 0
+        
+        return True
+    
+    def _readBulk(self, tfsLines, tfsType):
+        """
+        Parses all data lines in one pass with the NumPy text parser. Returns False if the data
+        block is irregular, in which case the file should be read line by line instead.
+        """
+        
+        try:
+            tfsData = np.loadtxt(tfsLines,dtype=tfsType,comments=None,ndmin=1)
+        except ValueError as e:
+            logger.warning("Bulk parsing failed, falling back to line parser: %s" % str(e))
+            return False
+        
+        for vN in self.varNames:
+            if tfsType[vN].kind == "O":
+                self.Data[vN] = self.stripQuotes(np.asarray(tfsData[vN],dtype="str"))
+            else:
+                self.Data[vN] = tfsData[vN]
+        self.nLines = len(tfsData)
+        
+        return True
+    
+    def _readLines(self):
+        """
+        Legacy line by line parser for the data block.
+        """
+        
+        self.Data   = {vN:[] for vN in self.varNames}
+        self.nLines = 0
+        
+        with openFile(self.fileName,'rt') as tfsFile:
+            for tfsLine in tfsFile:
+                if tfsLine[0] in "@*$":
+                    continue
+                spLines = tfsLine.split()
+                assert len(spLines) == len(self.varNames)
+                for (spLine,vN,vT) in zip(spLines,self.varNames,self.varTypes):
+                    self.Data[vN].append(spLine)
+                    if vT == "%s":
+                        self.Data[vN][-1] = self.stripQuotes(self.Data[vN][-1])
+                self.nLines += 1
+        
+        # Converting arrays to Numpy
+        for (vN,vT) in zip(self.varNames,self.varTypes):
+            if   vT[-1] == "d":
+                self.Data[vN] = np.asarray(self.Data[vN],dtype="int")
+            elif vT[-1] == "e":
+                self.Data[vN] = np.asarray(self.Data[vN],dtype="float")
+            elif vT[-1] == "s":
+                self.Data[vN] = np.asarray(self.Data[vN],dtype="str")
+        
+        return
+    
     def stripQuotes(self, sVar):
+        """
+        Strips one pair of matching quotes from a string, or from every element of a string array.
+        """
+        
+        if isinstance(sVar,np.ndarray):
+            for qChar in ("'", '"'):
+                isQuoted = np.char.startswith(sVar,qChar) & np.char.endswith(sVar,qChar) & (np.char.str_len(sVar) > 1)
+                if isQuoted.any():
+                    sVar = np.where(isQuoted,np.char.strip(sVar,qChar),sVar)
+            if sVar.size > 0:
+                sVar = sVar.astype("U%d" % max(np.char.str_len(sVar).max(),1))
+            return sVar
         
         if (sVar[0] == sVar[-1]) and sVar.startswith(("'", '"')):
             return sVar[1:-1]
@@ -16,10 +16,13 @@ import h5py
 
 from os       import path, listdir, stat
 from datetime import datetime
+from zipfile  import ZipFile, is_zipfile
 
-from sttools.functions         import parseKeyWordArgs
-from sttools.filetools.colmaps import STColMaps
-from sttools.filetools.stdump  import STDump
+from sttools.functions           import parseKeyWordArgs
+from sttools.filetools.colmaps   import STColMaps
+from sttools.filetools.stdump    import STDump
+from sttools.filetools.stdumpbin import STDumpBin
+from sttools.filetools.colcache  import ColCache
 
 logger = logging.getLogger(__name__)
 
@@ -46,19 +49,27 @@ class FileWrapper():
             "forceAccept" : False,
             "loadOnly"    : None,
             "isSingular"  : False,
+            "useCache"    : False,
+            "cacheDir"    : None,
+            "dumpFormat"  : None,
         }
         kwArgs = parseKeyWordArgs(valArgs, theArgs)
 
         self.stFile      = None
+        self.colCache    = None
         self.forceAccept = kwArgs["forceAccept"]
         self.loadOnly    = kwArgs["loadOnly"]
         self.isSingular  = kwArgs["isSingular"]
+        self.dumpFormat  = kwArgs["dumpFormat"]
         if kwArgs["orderBy"] in self.ORDERBY_VALID:
             self.orderBy = kwArgs["orderBy"]
         else:
             logger.error("OrderBy value %d is invalid" % kwArgs["orderBy"])
             return
 
+        if kwArgs["useCache"] or kwArgs["cacheDir"] is not None:
+            self.colCache = ColCache(kwArgs["cacheDir"])
+
         if self.isSingular:
             self.simMeta["SixTrackSim"] = {
                 "SimPath"   : simFolder,
@@ -92,7 +103,7 @@ class FileWrapper():
                 raise KeyError("Simulation key does not exist in this set.")
         else:
             raise KeyError("Key value must be either a string or an integer.")
-        self.stFile = SimWrapper(simKey,self.simMeta[simKey])
+        self.stFile = SimWrapper(simKey,self.simMeta[simKey],self.colCache,self.dumpFormat)
         logger.info("Loading dataset '%s'" % (simKey))
         return self.stFile
 
@@ -157,6 +168,8 @@ class FileWrapper():
     def _scanFolder(self):
         """Scans a folder for simulation subfolders and builds a list of valid ones.
         A valid folder contains at least a fort.2 and fort.3 file.
+        Zip archives, like the simFiles.NNNNN.zip files written by SixTrackJob, are also accepted,
+        and each archive is treated as one simulation.
         """
 
         self.simList = []
@@ -175,6 +188,23 @@ class FileWrapper():
             fStatus = "Checking item '%s'" % fName
             if fName[0] == ".":
                 continue
+            if path.isfile(fPath) and fName.lower().endswith(".zip") and is_zipfile(fPath):
+                fBase = path.splitext(fName)[0]
+                if fName not in self.loadOnly and fBase not in self.loadOnly:
+                    logger.info("%-56s [Ignored]" % fStatus)
+                    continue
+                logger.info("%-56s [Archive]" % fStatus)
+                readList.append(fBase)
+                self.simMeta[fBase] = {
+                    "SimPath"   : fPath,
+                    "SimName"   : fBase,
+                    "SimArch"   : fPath,
+                    "DataFiles" : self._scanArchFiles(fPath),
+                    "DataSets"  : self._scanArchSets(fPath),
+                }
+                if self.orderBy == self.ORDERBY_NAME:
+                    sortList.append(fBase)
+                continue
             if path.isfile(fPath):
                 logger.info("%-56s [Not a Simulation]" % fStatus)
                 continue
@@ -232,16 +262,43 @@ class FileWrapper():
                 self.simSets.append(fName)
         return setsList
 
+    def _scanArchFiles(self, archPath):
+        """List all the files in a simulation archive, from the zip central directory.
+        """
+        with ZipFile(archPath,mode="r") as zFile:
+            fileList = [zInfo.filename for zInfo in zFile.infolist() if not zInfo.is_dir()]
+        return fileList
+
+    def _scanArchSets(self, archPath):
+        """Same as _scanSets, but for the files in a simulation archive.
+        """
+        setsList = []
+        with ZipFile(archPath,mode="r") as zFile:
+            for zInfo in zFile.infolist():
+                if zInfo.is_dir():        continue
+                if zInfo.file_size == 0: continue
+                setsList.append(zInfo.filename)
+                if zInfo.filename not in self.simSets:
+                    self.simSets.append(zInfo.filename)
+        return setsList
+
 # END Class FileWrapper
 
 class SimWrapper():
 
-    simName = None
-    simMeta = None
+    simName    = None
+    simMeta    = None
+    colCache   = None
+    dumpFormat = None
 
-    def __init__(self, simName, simMeta):
-        self.simName = simName
-        self.simMeta = simMeta
+    def __init__(self, simName, simMeta, colCache=None, dumpFormat=None):
+        """Wraps the datasets of a single simulation. dumpFormat maps the names of datasets that
+        are binary dump files to their dump format, as the format cannot be detected from the file.
+        """
+        self.simName    = simName
+        self.simMeta    = simMeta
+        self.colCache   = colCache
+        self.dumpFormat = {} if dumpFormat is None else dumpFormat
         return
 
     def __contains__(self, dataSet):
@@ -253,19 +310,54 @@ class SimWrapper():
     def __getitem__(self, dataSet):
         if dataSet not in self.simMeta["DataSets"]:
             return None
-        dsPath  = path.join(self.simMeta["SimPath"],dataSet)
-        tmpData = STDump(dsPath)
-        tmpData.readAll()
-        retData = {}
+        return self.readSet(dataSet)
+
+    def readSet(self, dataSet, columns=None, filterBy=None, nWorkers=1):
+        """Reads a dataset into a dictionary of columns. If columns or filterBy is set, only those
+        columns and the rows matching the filter are read, see STDump.readAll. Column names are
+        the remapped names if the dataset is in STColMaps. Raises a KeyError for unknown column
+        names, and returns None if the dataset cannot be read.
+        """
+        tmpData = self.openSet(dataSet)
+        if tmpData is None:
+            return None
         if dataSet in STColMaps.MAP_COLS.keys():
             logger.debug("Remapping columns of datset '%s'" % dataSet)
-            for colName in tmpData.colNames:
-                logger.debug(" * %-20s = %-20s" % (colName,STColMaps.MAP_COLS[dataSet][colName]))
-                retData[STColMaps.MAP_COLS[dataSet][colName]] = tmpData.allData[colName]
+            colMap = STColMaps.MAP_COLS[dataSet]
         else:
             logger.debug("Not remapping columns of datset '%s'" % dataSet)
-            for colName in tmpData.colNames:
-                retData[colName] = tmpData.allData[colName]
-        return retData
+            colMap = {}
+        rawName = {colMap.get(cN,cN):cN for cN in tmpData.colNames}
+        for cN in list(columns or []) + list((filterBy or {}).keys()):
+            if cN not in rawName:
+                raise KeyError("Column '%s' does not exist in dataset '%s'." % (cN,dataSet))
+        if columns is not None:
+            columns = [rawName[cN] for cN in columns]
+        if filterBy is not None:
+            filterBy = {rawName[cN]:fV for cN, fV in filterBy.items()}
+        if not tmpData.readAll(columns=columns,filterBy=filterBy,nWorkers=nWorkers):
+            return None
+        return {colMap.get(cN,cN):tmpData.allData[cN] for cN in tmpData.colNames if cN in tmpData.allData}
+
+    def openSet(self, dataSet):
+        """Returns the file object of a dataset without reading the data, or None if the dataset
+        cannot be opened.
+        """
+        if dataSet in self.dumpFormat.keys():
+            if "SimArch" in self.simMeta.keys():
+                logger.error("Binary dump '%s' cannot be read from an archive" % dataSet)
+                return None
+            tmpData = STDumpBin(path.join(self.simMeta["SimPath"],dataSet),self.dumpFormat[dataSet])
+        elif "SimArch" in self.simMeta.keys():
+            tmpData = STDump(dataSet,zipArch=self.simMeta["SimArch"])
+        else:
+            dsPath = path.join(self.simMeta["SimPath"],dataSet)
+            if STDumpBin.isBinary(dsPath):
+                logger.error("Dataset '%s' looks like a binary dump, set its format in dumpFormat" % dataSet)
+                return None
+            tmpData = STDump(dsPath,colCache=self.colCache)
+        if not tmpData.validFile:
+            return None
+        return tmpData
 
 # END Class SimWrapper
@@ -12,13 +12,38 @@
 
 import logging
 import sttools
+import numpy as np
 import pprint
 import datetime
+import gzip
+import bz2
+import lzma
+import io
 
-from os import path
+from os      import path
+from zipfile import ZipFile
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 logger = logging.getLogger(__name__)
 
+# Magic bytes and extensions of supported compressed file formats
+COMPRESS_MAGIC = {
+    "gzip" : b"\x1f\x8b",
+    "bz2"  : b"BZh",
+    "xz"   : b"\xfd7zXZ\x00",
+    "zstd" : b"\x28\xb5\x2f\xfd",
+}
+COMPRESS_EXT = {
+    ".gz"  : "gzip",
+    ".bz2" : "bz2",
+    ".xz"  : "xz",
+    ".zst" : "zstd",
+}
+
 def formatNumberExp(floatVal, formatString="%7.2f", expSize=2, nullLimit=1e-18):
 
     expVal = 0
@@ -89,6 +114,31 @@ def symmetricRange(minVal, maxVal, meanVal):
     extVal  = max(abs(minVal),abs(maxVal))
     return meanVal-extVal, meanVal+extVal
 
+def filterMask(colData, filterBy):
+    """Evaluates a row filter on a dictionary of column arrays and returns a boolean mask.
+    The filter is a dictionary of column name and condition, and all conditions must be met.
+    A condition can be:
+      * a tuple (minVal, maxVal), inclusive, where either limit may be None
+      * a list, set or array of accepted values
+      * a function taking the column array and returning a boolean array
+      * a single accepted value
+    """
+    rowMask = np.ones(len(colData[list(colData.keys())[0]]),dtype=bool)
+    for cN, fVal in filterBy.items():
+        cData = colData[cN]
+        if callable(fVal):
+            rowMask &= np.asarray(fVal(cData),dtype=bool)
+        elif isinstance(fVal,tuple):
+            if fVal[0] is not None:
+                rowMask &= cData >= fVal[0]
+            if fVal[1] is not None:
+                rowMask &= cData <= fVal[1]
+        elif isinstance(fVal,(list,set,frozenset,np.ndarray)):
+            rowMask &= np.isin(cData,list(fVal))
+        else:
+            rowMask &= cData == fVal
+    return rowMask
+
 def getTimeStamp(dateSep=" "):
     timeValue  = datetime.datetime.now()
     returnDate = "{:%Y-%m-%d}".format(timeValue)
@@ -104,3 +154,62 @@ def parsePath(inString, defaultPath, defaultFile):
     if path.isdir(inString):
         return inString
     return path.join(defaultPath,defaultFile)
+
+def fileCompression(fileName):
+    """Returns the compression format of a file, or None if it is not compressed. The format is
+    detected from the first bytes of the file, or from the extension if the file does not exist.
+    """
+    if path.isfile(fileName):
+        with open(fileName,mode="rb") as inFile:
+            fileMagic = inFile.read(6)
+        for cmpName, cmpMagic in COMPRESS_MAGIC.items():
+            if fileMagic.startswith(cmpMagic):
+                return cmpName
+        return None
+    return COMPRESS_EXT.get(path.splitext(fileName)[1].lower(), None)
+
+def openFile(fileName, fileMode="rt", zipArch=None):
+    """Opens a file with transparent streaming decompression of gzip, bz2, xz and, if the
+    zstandard package is installed, zstd files. Otherwise the file is opened as normal.
+    Files opened for reading are checked for compression by content, and files opened for writing
+    are compressed according to their extension.
+    If zipArch is set, fileName is the name of a member of that zip archive, which is opened for
+    reading and streamed directly from the archive.
+    """
+    if zipArch is not None:
+        with ZipFile(zipArch,mode="r") as zFile:
+            # The member keeps the archive file open until it is closed itself
+            zMember = zFile.open(fileName,mode="r")
+        if "b" in fileMode:
+            return zMember
+        return io.TextIOWrapper(zMember,encoding="utf-8")
+
+    if fileMode[0] == "r":
+        cmpName = fileCompression(fileName)
+    else:
+        cmpName = COMPRESS_EXT.get(path.splitext(fileName)[1].lower(), None)
+    isText = "b" not in fileMode
+    if isText and "t" not in fileMode:
+        # The compression modules default to binary mode
+        fileMode += "t"
+
+    if cmpName is None:
+        return open(fileName,mode=fileMode)
+    if cmpName == "gzip":
+        return gzip.open(fileName,mode=fileMode)
+    if cmpName == "bz2":
+        return bz2.open(fileName,mode=fileMode)
+    if cmpName == "xz":
+        return lzma.open(fileName,mode=fileMode)
+
+    if zstandard is None:
+        raise ValueError("File '%s' is zstd compressed, but zstandard is not installed" % fileName)
+    if fileMode[0] == "r":
+        zFile = zstandard.ZstdDecompressor().stream_reader(
+            open(fileName,mode="rb"),closefd=True,read_across_frames=True
+        )
+    else:
+        zFile = zstandard.ZstdCompressor().stream_writer(open(fileName,mode="wb"),closefd=True)
+    if isText:
+        return io.TextIOWrapper(zFile,encoding="utf-8")
+    return zFile
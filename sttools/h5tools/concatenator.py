@@ -64,23 +64,187 @@ class Concatenator:
             self.metaFile[path.splitext(h5File)[0]] = h5py.ExternalLink(h5File, self.inFolder)
         return True
 
-    # ToDo!
-    # def writeFullFile(self, fileName="concatfile.h5"):
-    #     mFileName = path.join(self.inFolder,fileName)
-    #     self.metaFile = h5py.File(mFileName,"w")
-    #     for h5File in self.fileList:
-    #         print("%-40s : %-40s" % (h5File,path.basename(h5File)))
-    #         if path.samefile(mFileName,path.join(self.inFolder,h5File)):
-    #             # Don't link to itself!
-    #             continue
-    #         self.metaFile[path.splitext(h5File)[0]] = h5py.ExternalLink(h5File, self.inFolder)
-    #     return True
+    def writeVirtualFile(self, fileName="virtualfile.h5", dataSets=None, addSimIndex=True):
+        """Creates an HDF5 file where each dataset is a virtual dataset that maps the same dataset
+        in all files, one after the other, so no data is copied. If dataSets is set, only those
+        datasets are mapped. The source file names are saved in the dataset SIMS. Files written by
+        writeFullFile and writeVirtualFile are not mapped.
+
+        If addSimIndex is True, the index of the source file of each row is available as the
+        virtual dataset SIM/<dataset>. It maps, for each file, a dataset in the group SIMFILL that
+        is never written and only holds the file index as fill value, so it takes no space.
+        """
+        mFileName = path.join(self.inFolder,fileName)
+        mFilePath = path.dirname(path.abspath(mFileName))
+        simFiles  = []
+        setParts  = {}
+        simRows   = []
+        for h5File, inPath in self._inputFiles(mFileName):
+            simIdx = len(simFiles)
+            simFiles.append(h5File)
+            simRows.append(0)
+            with h5py.File(inPath,"r") as inFile:
+                for setName in self._listSets(inFile):
+                    if dataSets is not None and setName not in dataSets:
+                        continue
+                    if self._isReserved(setName):
+                        logger.error("Dataset name '%s' is used by the virtual file, skipping" % setName)
+                        continue
+                    inSet = inFile[setName]
+                    if len(inSet.shape) == 0:
+                        continue
+                    if setName in setParts and setParts[setName][0][3] != inSet.dtype:
+                        logger.error("Dataset '%s' in SIM %d has a different type, skipping" % (setName,simIdx))
+                        continue
+                    setParts.setdefault(setName,[]).append(
+                        (simIdx,path.relpath(path.abspath(inPath),mFilePath),inSet.shape,inSet.dtype)
+                    )
+                    simRows[simIdx] = max(simRows[simIdx],inSet.shape[0])
+
+        with h5py.File(mFileName,"w") as virtFile:
+            virtFile.create_dataset("SIMS",data=np.array(simFiles,dtype="S"))
+            if addSimIndex:
+                for simIdx, nRows in enumerate(simRows):
+                    virtFile.create_dataset(
+                        "SIMFILL/%d" % simIdx, shape=(max(nRows,1),), dtype="<i4",
+                        chunks=True, fillvalue=simIdx
+                    )
+            for setName, setList in setParts.items():
+                nTotal    = sum([sP[2][0] for sP in setList])
+                setLayout = h5py.VirtualLayout(shape=(nTotal,)+setList[0][2][1:],dtype=setList[0][3])
+                simLayout = h5py.VirtualLayout(shape=(nTotal,),dtype="<i4")
+                rowBeg    = 0
+                for simIdx, srcFile, srcShape, srcType in setList:
+                    rowEnd = rowBeg + srcShape[0]
+                    setLayout[rowBeg:rowEnd] = h5py.VirtualSource(srcFile,setName,shape=srcShape)
+                    if addSimIndex and srcShape[0] > 0:
+                        simLayout[rowBeg:rowEnd] = h5py.VirtualSource(
+                            ".","SIMFILL/%d" % simIdx,shape=(simRows[simIdx],)
+                        )[:srcShape[0]]
+                    rowBeg = rowEnd
+                virtFile.create_virtual_dataset(setName,setLayout)
+                if addSimIndex:
+                    virtFile.create_virtual_dataset("SIM/"+setName,simLayout)
+
+        logger.info("Mapped %d datasets from %d files into %s" % (len(setParts),len(simFiles),mFileName))
+
+        return True
+
+    def writeFullFile(self, fileName="concatfile.h5", blockSize=1000000, chunkSize=65536, compression="gzip"):
+        """Merges all datasets of all files into a single HDF5 file. Each dataset is written to a
+        chunked and compressed dataset of the same name, which is extended as the files are read,
+        with an added SIM column holding the index of the source file. The source file names are
+        saved in the dataset SIMS. The files are copied in blocks of blockSize rows, so at most one
+        block is held in memory. Datasets that are not compound are stored in a VALUE column.
+        Files written by writeFullFile and writeVirtualFile are not merged.
+        """
+        mFileName = path.join(self.inFolder,fileName)
+        simFiles  = []
+        with h5py.File(mFileName,"w") as fullFile:
+            for h5File, inPath in self._inputFiles(mFileName):
+                simIdx = len(simFiles)
+                simFiles.append(h5File)
+                logger.info("Appending file %s as SIM %d" % (h5File,simIdx))
+                with h5py.File(inPath,"r") as inFile:
+                    for setName in self._listSets(inFile):
+                        if setName == "SIMS":
+                            logger.error("Dataset name 'SIMS' is used by the merged file, skipping")
+                            continue
+                        self._appendSet(fullFile,inFile[setName],setName,simIdx,blockSize,chunkSize,compression)
+            fullFile.create_dataset("SIMS",data=np.array(simFiles,dtype="S"))
+
+        logger.info("Merged %d files into %s" % (len(simFiles),mFileName))
+
+        return True
 
     def extractAppend(self, dataSet, dataCol):
+        """Reads one column of a dataset from all files, and returns it as a single array. Files
+        without the dataset are skipped.
+        """
+        colParts = []
+        for inFile, filePath in self._inputFiles():
+            with h5py.File(filePath, mode="r") as h5File:
+                if dataSet not in h5File:
+                    logger.debug("No dataset '%s' in file %s" % (dataSet,inFile))
+                    continue
+                h5Set = h5File[dataSet]
+                if h5Set.dtype.names is None or dataCol not in h5Set.dtype.names:
+                    logger.error("No column '%s' in dataset '%s'" % (dataCol,dataSet))
+                    return False
+                colParts.append(h5Set.fields(dataCol)[:])
+
+        if len(colParts) == 0:
+            logger.error("Dataset '%s' not found in any file" % dataSet)
+            return False
+
+        return np.concatenate(colParts)
+
+    #
+    #  Internal Functions
+    #
+
+    def _inputFiles(self, outFile=None):
+        """Returns the name and path of the files to read, skipping outFile and the files written
+        by writeFullFile and writeVirtualFile, which would otherwise be read as simulations.
+        """
+        inFiles = []
+        for h5File in self.fileList:
+            inPath = path.join(self.inFolder,h5File)
+            if outFile is not None and path.isfile(outFile) and path.samefile(outFile,inPath):
+                continue
+            with h5py.File(inPath,"r") as inFile:
+                isOutput = isinstance(inFile.get("SIMS",None),h5py.Dataset) or any(
+                    inFile[setName].is_virtual for setName in self._listSets(inFile)
+                )
+            if isOutput:
+                logger.info("Skipping file %s, which is a concatenated file" % h5File)
+                continue
+            inFiles.append((h5File,inPath))
+        return inFiles
+
+    def _isReserved(self, setName):
+        return setName == "SIMS" or setName.split("/")[0] in ("SIM","SIMFILL")
 
-        for inFile in self.fileList:
-            filePath = path.join(self.inFolder,inFile)
-            h5File = h5py.File(filePath, mode="r")
+    def _listSets(self, h5File):
+        setList = []
+        h5File.visititems(lambda n, o: setList.append(n) if isinstance(o, h5py.Dataset) else None)
+        return setList
+
+    def _appendSet(self, fullFile, inSet, setName, simIdx, blockSize, chunkSize, compression):
+        """Appends one dataset to the merged file in blocks, adding the SIM column.
+        """
+        if inSet.dtype.names is None:
+            inFields = [("VALUE",inSet.dtype,inSet.shape[1:])]
+        else:
+            inFields = [(fN,inSet.dtype.fields[fN][0]) for fN in inSet.dtype.names]
+        outType = np.dtype(inFields + [("SIM","<i4")])
+
+        if setName in fullFile:
+            outSet = fullFile[setName]
+            if outSet.dtype != outType:
+                logger.error("Dataset '%s' in SIM %d has a different type, skipping" % (setName,simIdx))
+                return False
+        else:
+            outSet = fullFile.create_dataset(
+                setName, shape=(0,), maxshape=(None,), dtype=outType,
+                chunks=(chunkSize,), compression=compression, shuffle=True
+            )
+            for aName, aValue in inSet.attrs.items():
+                outSet.attrs[aName] = aValue
+
+        nRows = inSet.shape[0] if len(inSet.shape) > 0 else 0
+        for rowBeg in range(0,nRows,blockSize):
+            inBlock  = inSet[rowBeg:rowBeg+blockSize]
+            outBlock = np.empty(len(inBlock),dtype=outType)
+            if inSet.dtype.names is None:
+                outBlock["VALUE"] = inBlock
+            else:
+                for fN in inSet.dtype.names:
+                    outBlock[fN] = inBlock[fN]
+            outBlock["SIM"] = simIdx
+            outEnd = outSet.shape[0]
+            outSet.resize((outEnd+len(outBlock),))
+            outSet[outEnd:] = outBlock
 
         return True
 
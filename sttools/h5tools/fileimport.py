@@ -16,7 +16,7 @@ import h5py
 
 from os import path
 
-from sttools.filetools import TableFS, STDump
+from sttools.filetools import TableFS, STDump, STDumpBin
 
 logger = logging.getLogger(__name__)
 
@@ -65,20 +65,32 @@ class H5Import:
     #
     #  Import SixTrack DUMP File
     #
-    def importDump(self, dataFile):
+    def importDump(self, dataFile, bezName=None, dumpFormat=None):
         """
         Import SixTrack DUMP File
-        Currently only supports DUMP format #2
+        Currently supports DUMP format #2, and the binary DUMP format #3
+        Binary dump files must be selected with dumpFormat, as several binary formats share the
+        same record layout. Since they have no header, the element name is taken from bezName, or
+        else from the file name.
         """
         
         if not path.isfile(dataFile):
             logger.error("File not found %s" % dataFile)
             return False
         
-        stData = STDump(dataFile)
+        if dumpFormat is None and STDumpBin.isBinary(dataFile):
+            logger.error("%s looks like a binary dump, set dumpFormat to read it" % path.basename(dataFile))
+            return False
+        
+        if dumpFormat in STDumpBin.FORMATS.keys():
+            if bezName is None:
+                bezName = path.splitext(path.basename(dataFile))[0]
+            stData = STDumpBin(dataFile, dumpFormat, bezName)
+        else:
+            stData = STDump(dataFile)
         stData.readAll()
         
-        if stData.metaData["FORMAT"] == "DUMP format #2":
+        if stData.metaData["FORMAT"] in ("DUMP format #2","DUMP format #3"):
             
             if stData.nLines == 0:
                 logger.error("The dump file has no data")
@@ -88,7 +100,10 @@ class H5Import:
             bezName = stData.metaData["BEZ"]
             bezPos  = float(stData.allData["S"][0])
             kTrack  = int(stData.allData["KTRACK"][0])
-            nPart   = int(stData.metaData["NUMBER_OF_PARTICLES"])
+            if "NUMBER_OF_PARTICLES" in stData.metaData.keys():
+                nPart = int(stData.metaData["NUMBER_OF_PARTICLES"])
+            else:
+                nPart = len(np.unique(stData.allData["ID"]))
             
             # Save Data
             h5Data = np.core.records.fromarrays(
@@ -13,9 +13,12 @@
 import logging
 import numpy as np
 import h5py
+import json
 
-from os       import path, listdir
-from datetime import datetime
+from os                 import path, listdir, stat, replace, getpid, cpu_count
+from datetime           import datetime
+from collections        import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 
 from sttools.functions     import pPrintDict, parseKeyWordArgs
 from sttools.h5tools.utils import H5Utils
@@ -30,6 +33,9 @@ class H5Wrapper():
 
     ORDERBY_VALID = [0,1,2]
 
+    CATALOG_FILE    = ".sttools_catalog.json"
+    CATALOG_VERSION = 2
+
     simList = [] # The list of accepted files, in order
     simMeta = {} # The meta data of the files
     simSets = [] # A list of all datasets across simulations
@@ -45,13 +51,24 @@ class H5Wrapper():
             "orderBy"     : self.ORDERBY_SIMNO,
             "forceAccept" : False,
             "loadOnly"    : None,
+            "nWorkers"    : min(8,cpu_count() or 1),
+            "useCatalog"  : False,
+            "maxOpen"     : 16,
+            "cacheBytes"  : 16*1024**2,
+            "cacheSlots"  : 10007,
         }
         kwArgs = parseKeyWordArgs(valArgs, theArgs)
 
         self.h5File      = None
+        self.h5Pool      = OrderedDict()
         self.simFolder   = simFolder
         self.forceAccept = kwArgs["forceAccept"]
         self.loadOnly    = kwArgs["loadOnly"]
+        self.nWorkers    = max(1,kwArgs["nWorkers"])
+        self.useCatalog  = kwArgs["useCatalog"]
+        self.maxOpen     = max(1,kwArgs["maxOpen"])
+        self.cacheBytes  = kwArgs["cacheBytes"]
+        self.cacheSlots  = kwArgs["cacheSlots"]
         if kwArgs["orderBy"] in self.ORDERBY_VALID:
             self.orderBy = kwArgs["orderBy"]
         else:
@@ -82,9 +99,7 @@ class H5Wrapper():
                 raise KeyError("Simulation key does not exist in this set.")
         else:
             raise KeyError("Key value must be either a string or an integer.")
-        fPath = self.simMeta[simKey]["SimPath"]
-        self.h5File = h5py.File(fPath,"r")
-        logger.info("Loading dataset '%s'" % (simKey))
+        self.h5File = self._openFile(simKey)
         return self.h5File
 
     def __iter__(self):
@@ -121,8 +136,13 @@ class H5Wrapper():
     #
 
     def close(self):
-        if self.h5File is not None:
-            self.h5File.close()
+        """Closes all open files in the handle pool.
+        """
+        while len(self.h5Pool) > 0:
+            simKey, h5File = self.h5Pool.popitem(last=False)
+            if h5File:
+                h5File.close()
+        self.h5File = None
 
     def checkDataSetKey(self, reqSet):
         """Check if a dataset exists and if necessary translate the key.
@@ -154,15 +174,45 @@ class H5Wrapper():
     #  Internal Functions
     #
 
+    def _openFile(self, simKey):
+        """Returns an open read-only handle to a simulation file. Up to maxOpen handles are kept
+        open, and the least recently used handle is closed when a new file is opened. Each handle
+        has its own chunk cache of cacheBytes bytes and cacheSlots hash slots.
+        """
+        if simKey in self.h5Pool.keys():
+            if self.h5Pool[simKey]:
+                self.h5Pool.move_to_end(simKey)
+                return self.h5Pool[simKey]
+            # The handle was closed from outside the pool
+            del self.h5Pool[simKey]
+
+        fPath  = self.simMeta[simKey]["SimPath"]
+        h5File = h5py.File(fPath,"r",rdcc_nbytes=self.cacheBytes,rdcc_nslots=self.cacheSlots)
+        logger.info("Loading dataset '%s'" % (simKey))
+
+        self.h5Pool[simKey] = h5File
+        while len(self.h5Pool) > self.maxOpen:
+            oldKey, oldFile = self.h5Pool.popitem(last=False)
+            logger.debug("Closing dataset '%s'" % (oldKey))
+            if oldFile:
+                oldFile.close()
+
+        return h5File
+
     def _scanFolder(self):
         """Scans a folder for HDF5 files and builds a list of valid ones.
         A valid file contains a "CreatedBy" field that states the file was written by SixTrack.
+        The files are scanned in a pool of nWorkers processes. If useCatalog is True, the result is
+        saved in a catalog file in the folder, and if it is a file path, in that file instead. On
+        later scans, only files with a changed size, modification time or forceAccept setting are
+        opened again.
         """
 
         self.simList = []
         self.simMeta = {}
+        self.simSets = []
 
-        fileList = listdir(self.simFolder)
+        fileList = sorted(listdir(self.simFolder))
         sortList = []
         readList = []
         logger.info("Loading files from '%s'" % self.simFolder)
@@ -170,39 +220,68 @@ class H5Wrapper():
         if self.loadOnly is None:
             self.loadOnly = fileList.copy()
 
+        if isinstance(self.useCatalog,str):
+            catPath = self.useCatalog
+        elif self.useCatalog:
+            catPath = path.join(self.simFolder,self.CATALOG_FILE)
+        else:
+            catPath = None
+        catFiles = self._readCatalog(catPath) if catPath is not None else {}
+        newFiles = {}
+        toScan   = []
         for fName in fileList:
-            fBase, fExt = path.splitext(fName)
-            fPath       = path.join(self.simFolder,fName)
-            fStatus     = "Checking file '%s'" % fName
+            if fName == self.CATALOG_FILE:
+                continue
+            if catPath is not None and path.abspath(path.join(self.simFolder,fName)) == path.abspath(catPath):
+                continue
+            fStatus = "Checking file '%s'" % fName
             if fName not in self.loadOnly:
                 logger.info("%-56s [Ignored]" % fStatus)
                 continue
-            try:
-                fH5 = h5py.File(fPath,"r")
-            except:
-                logger.info("%-56s [Not HDF5]" % fStatus)
-                continue
-            if not self.forceAccept and not H5Utils.getAttrString(fH5,"CreatedBy")[:8] == "SixTrack":
-                logger.info("%-56s [Not SixTrack]" % fStatus)
+            fStat  = stat(path.join(self.simFolder,fName))
+            fEntry = catFiles.get(fName,None)
+            if fEntry is not None and \
+                fEntry["Size"] == fStat.st_size and \
+                fEntry["MTime"] == fStat.st_mtime_ns and \
+                fEntry.get("ForceAccept",None) == self.forceAccept:
+                newFiles[fName] = fEntry
+            else:
+                newFiles[fName] = {
+                    "Size"        : fStat.st_size,
+                    "MTime"       : fStat.st_mtime_ns,
+                    "ForceAccept" : self.forceAccept,
+                }
+                toScan.append(fName)
+
+        # Scan new and changed files
+        scanPaths = [path.join(self.simFolder,fName) for fName in toScan]
+        if len(toScan) > 1 and self.nWorkers > 1:
+            with ProcessPoolExecutor(max_workers=min(self.nWorkers,len(toScan))) as poolExec:
+                scanRes = list(poolExec.map(
+                    _scanFile,scanPaths,[self.forceAccept]*len(toScan),
+                    chunksize=max(1,len(toScan)//(4*self.nWorkers))
+                ))
+        else:
+            scanRes = [_scanFile(fPath,self.forceAccept) for fPath in scanPaths]
+        for fName, (fState, fMeta) in zip(toScan,scanRes):
+            newFiles[fName]["Status"] = fState
+            newFiles[fName]["Meta"]   = fMeta
+
+        logger.info("Scanned %d file(s), %d unchanged file(s) read from catalog" % (
+            len(toScan),len(newFiles)-len(toScan)
+        ))
+
+        for fName in newFiles.keys():
+            fStatus = "Checking file '%s'" % fName
+            logger.info("%-56s [%s]" % (fStatus,newFiles[fName]["Status"]))
+            if newFiles[fName]["Status"] != "OK":
                 continue
-            logger.info("%-56s [OK]" % fStatus)
-            timeStamp = H5Utils.getAttrString(fH5,"TimeStamp")
-            self.simMeta[fBase] = {
-                "TimeStamp"  : timeStamp,
-                "NumTime"    : datetime.strptime(timeStamp,"%Y-%m-%dT%H:%M:%S.%f").timestamp(),
-                "CreatedBy"  : H5Utils.getAttrString(fH5,"CreatedBy"),
-                "SimNumber"  : fH5.attrs["SimNumber"][0],
-                "Particles"  : fH5.attrs["Particles"][0],
-                "Turns"      : fH5.attrs["Turns"][0],
-                "PreTime"    : fH5.attrs["PreTime"][0],
-                "TrackTime"  : fH5.attrs["TrackTime"][0],
-                "PostTime"   : fH5.attrs["PostTime"][0],
-                "TotalTime"  : fH5.attrs["TotalTime"][0],
-                "FileName"   : fName,
-                "SimPath"    : fPath,
-                "SimName"    : fBase,
-                "DataSets"   : self._scanSets(fH5),
-            }
+            fBase, fExt = path.splitext(fName)
+            self.simMeta[fBase] = dict(newFiles[fName]["Meta"])
+            self.simMeta[fBase]["SimPath"] = path.join(self.simFolder,fName)
+            for aSet in self.simMeta[fBase]["DataSets"]:
+                if aSet not in self.simSets:
+                    self.simSets.append(aSet)
             readList.append(fBase)
             if   self.orderBy == self.ORDERBY_SIMNO:
                 sortList.append(self.simMeta[fBase]["SimNumber"])
@@ -213,23 +292,86 @@ class H5Wrapper():
 
         self.simList = [x for _,x in sorted(zip(sortList,readList))]
 
-        fH5.close()
+        # Only files in loadOnly were checked, so keep the catalog entries of the others
+        if catPath is not None and (len(toScan) > 0 or len(catFiles) != len(newFiles)):
+            for fName in catFiles.keys():
+                if fName not in newFiles and fName in fileList:
+                    newFiles[fName] = catFiles[fName]
+            self._writeCatalog(catPath,newFiles)
 
         return True
 
-    def _scanSets(self, h5File):
-        tmpKeys = list(h5File.keys())
-        theSets = []
-        # Scan root and one layer of groups
-        for aKey in tmpKeys:
-            if isinstance(h5File[aKey], h5py.Dataset):
-                theSets.append(aKey)
-            else:
-                theSets += [aKey+"/"+x for x in list(h5File[aKey].keys())]
-        # Write all unique sets to the simSets list
-        for aSet in theSets:
-            if aSet not in self.simSets:
-                self.simSets.append(aSet)
-        return theSets
+    def _readCatalog(self, catPath):
+        if not path.isfile(catPath):
+            return {}
+        try:
+            with open(catPath,mode="rt") as catFile:
+                catData = json.load(catFile)
+        except (OSError,ValueError):
+            logger.warning("Ignoring unreadable catalog file %s" % catPath)
+            return {}
+        if catData.get("Version",None) != self.CATALOG_VERSION:
+            return {}
+        if catData.get("Folder",None) != path.abspath(self.simFolder):
+            logger.warning("Ignoring catalog file %s of another folder" % catPath)
+            return {}
+        return catData["Files"]
+
+    def _writeCatalog(self, catPath, catFiles):
+        tmpPath = catPath + ".%d.tmp" % getpid()
+        try:
+            with open(tmpPath,mode="wt") as catFile:
+                json.dump({
+                    "Version" : self.CATALOG_VERSION,
+                    "Folder"  : path.abspath(self.simFolder),
+                    "Files"   : catFiles,
+                },catFile)
+            replace(tmpPath,catPath)
+        except OSError as e:
+            logger.warning("Unable to write catalog file %s: %s" % (catPath,str(e)))
+            return False
+        return True
 
 # END Class H5Wrapper
+
+def _scanFile(fPath, forceAccept):
+    """Reads the meta data of a single HDF5 file. Returns the scan status and the meta data.
+    Runs in a worker process, and closes the file before returning.
+    """
+    try:
+        fH5 = h5py.File(fPath,"r")
+    except:
+        return "Not HDF5", None
+    with fH5:
+        if not forceAccept and not H5Utils.getAttrString(fH5,"CreatedBy")[:8] == "SixTrack":
+            return "Not SixTrack", None
+        fName       = path.basename(fPath)
+        fBase, fExt = path.splitext(fName)
+        timeStamp   = H5Utils.getAttrString(fH5,"TimeStamp")
+        fMeta = {
+            "TimeStamp"  : timeStamp,
+            "NumTime"    : datetime.strptime(timeStamp,"%Y-%m-%dT%H:%M:%S.%f").timestamp(),
+            "CreatedBy"  : H5Utils.getAttrString(fH5,"CreatedBy"),
+            "SimNumber"  : int(fH5.attrs["SimNumber"][0]),
+            "Particles"  : int(fH5.attrs["Particles"][0]),
+            "Turns"      : int(fH5.attrs["Turns"][0]),
+            "PreTime"    : float(fH5.attrs["PreTime"][0]),
+            "TrackTime"  : float(fH5.attrs["TrackTime"][0]),
+            "PostTime"   : float(fH5.attrs["PostTime"][0]),
+            "TotalTime"  : float(fH5.attrs["TotalTime"][0]),
+            "FileName"   : fName,
+            "SimName"    : fBase,
+            "DataSets"   : _scanSets(fH5),
+        }
+    return "OK", fMeta
+
+def _scanSets(h5File):
+    tmpKeys = list(h5File.keys())
+    theSets = []
+    # Scan root and one layer of groups
+    for aKey in tmpKeys:
+        if isinstance(h5File[aKey], h5py.Dataset):
+            theSets.append(aKey)
+        else:
+            theSets += [aKey+"/"+x for x in list(h5File[aKey].keys())]
+    return theSets
@@ -14,7 +14,8 @@
 import logging
 import numpy   as np
 
-from os import path
+from os                import path
+from sttools.functions import openFile
 
 logger = logging.getLogger(__name__)
 
@@ -79,7 +80,7 @@ class Fort2():
         whatStage = 0
         whatLine  = 0
 
-        with open(fort2File,"r") as inFile:
+        with openFile(fort2File,"rt") as inFile:
             whatLine += 1
             for theLine in inFile:
                 if   theLine[0:15] == self.nameElem:
@@ -15,7 +15,8 @@ import logging
 import numpy   as np
 import shlex
 
-from os import path
+from os                import path
+from sttools.functions import openFile
 
 logger = logging.getLogger(__name__)
 
@@ -74,7 +75,7 @@ class Fort3():
         inBlock   = False
         currBlock = ""
         
-        with open(fort3File,"r") as inFile:
+        with openFile(fort3File,"rt") as inFile:
             for theLine in inFile:
                 lineNo  += 1
                 theLine  = theLine.strip()
@@ -232,7 +233,7 @@ class Fort3():
             self.newBlock(blockName,longName)
             
         lineNo = 0
-        with open(filePath,"r") as inFile:
+        with openFile(filePath,"rt") as inFile:
             for theLine in inFile:
                 lineNo += 1
                 theLine = theLine.strip()
@@ -13,9 +13,9 @@
 import logging
 import numpy as np
 
-from os import path, listdir
+from os                 import path, listdir
 
-from sttools.functions         import parseKeyWordArgs, checkValue
+from sttools.functions         import parseKeyWordArgs, checkValue, filterMask
 from sttools.h5tools.wrapper   import H5Wrapper
 from sttools.filetools.wrapper import FileWrapper
 
@@ -37,7 +37,10 @@ class SixTrackSim():
         HDF5 files or subfolders presumably containing SixTrack simulation files. dataType is auto-
         detected but can be overridden. loadOnly gives a list of sets to load, excluding all else.
         orderBy defines how to order the sets, which defaults to order by name. forceAccept disables
-        any checks for whether the simulation set actually contains SixTrack data.
+        any checks for whether the simulation set actually contains SixTrack data. useCache and
+        cacheDir enable caching of parsed TEXT data, see ColCache. useCatalog saves the scan of HDF5
+        files in a catalog file, in the folder or at the given path, see H5Wrapper. dumpFormat maps
+        TEXT datasets that are binary dump files to their dump format, see STDumpBin.
         """
 
         if path.isdir(simFolder):
@@ -52,6 +55,10 @@ class SixTrackSim():
             "orderBy"     : 0,     # How to order simulation sets. 0 = by name.
             "forceAccept" : False, # Whether to ignore validity checks for simulation sets
             "isSingular"  : False, # Whether the folder contains files from a single simulation
+            "useCache"    : False, # Whether to cache parsed TEXT data as binary column files
+            "cacheDir"    : None,  # Where to store the cache. Defaults to next to the data files
+            "useCatalog"  : False, # Save the scan of HDF5 files in a catalog, True or a file path
+            "dumpFormat"  : None,  # Binary dump format of TEXT datasets, as {dataSet:format}
         }
         kwArgs = parseKeyWordArgs(valArgs, theArgs)
 
@@ -61,6 +68,7 @@ class SixTrackSim():
         nDirs   = 0
         nFiles  = 0
         nHDF5   = 0
+        nArch   = 0
         for simElem in simList:
             sPath       = path.join(simFolder,simElem)
             fBase, fExt = path.splitext(simElem)
@@ -68,12 +76,16 @@ class SixTrackSim():
             if path.isdir(sPath):  nDirs  += 1
             if path.isfile(sPath): nFiles += 1
             if fExt in h5List:     nHDF5  += 1
+            if fExt == ".zip":     nArch  += 1
         if nHDF5 > nDirs:
             logger.info("Found %d HDF5 file(s). Assuming dataType is HDF5." % nHDF5)
             self.dataType = self.TYPE_HDF5
         elif nDirs > nFiles:
             logger.info("Found %d folders. Assuming dataType is TEXT." % nDirs)
             self.dataType = self.TYPE_FILE
+        elif nArch > nDirs:
+            logger.info("Found %d zip archives. Assuming dataType is TEXT." % nArch)
+            self.dataType = self.TYPE_FILE
         elif nFiles > nDirs:
             logger.info("Found %d files. Assuming dataType is TEXT." % nFiles)
             self.dataType = self.TYPE_FILE
@@ -111,14 +123,18 @@ class SixTrackSim():
                 loadOnly    = kwArgs["loadOnly"],
                 orderBy     = kwArgs["orderBy"],
                 forceAccept = kwArgs["forceAccept"],
-                isSingular  = kwArgs["isSingular"]
+                isSingular  = kwArgs["isSingular"],
+                useCache    = kwArgs["useCache"],
+                cacheDir    = kwArgs["cacheDir"],
+                dumpFormat  = kwArgs["dumpFormat"],
             )
         else:
             self.simData = H5Wrapper(
                 simFolder,
                 loadOnly    = kwArgs["loadOnly"],
                 orderBy     = kwArgs["orderBy"],
-                forceAccept = kwArgs["forceAccept"]
+                forceAccept = kwArgs["forceAccept"],
+                useCatalog  = kwArgs["useCatalog"],
             )
 
         return
@@ -172,10 +188,125 @@ class SixTrackSim():
         self._checkValid()
         return self.simData.checkDataSetKey(reqSet)
 
+    def select(self, dataSet, columns, where=None, sims=None, nWorkers=4):
+        """Reads columns of a dataset across simulations into one contiguous array per column.
+        where is a row filter, see sttools.functions.filterMask, and sims is a list of simulation
+        names or indices, defaulting to all. Text simulations are read one at a time, parsing only
+        the requested columns and keeping only the rows matching where. Large files are parsed in
+        nWorkers processes, see STDump.readAll. HDF5 files are read through the open file handles
+        of the wrapper. The output is allocated from the dataset shapes, and each column is read
+        directly into its part of the output. Returns a dictionary of the columns, plus a SIM
+        column with the index of each row's simulation in the simulation list.
+        """
+        self._checkValid()
+
+        setKey = self.checkDataSetKey(dataSet)
+        if setKey is None:
+            raise KeyError("The requested dataset '%s' does not exist." % dataSet)
+
+        if sims is None:
+            sims = list(range(len(self.simData)))
+        simKeys = [self.simData.simList[s] if isinstance(s,int) else s for s in sims]
+        for simKey in simKeys:
+            if simKey not in self.simData.simList:
+                raise KeyError("Simulation key '%s' does not exist in this set." % simKey)
+
+        if where is None:
+            where = {}
+
+        if self.dataType == self.TYPE_HDF5:
+            readCols = list(columns) + [cN for cN in where.keys() if cN not in columns]
+            colData, simIdx = self._selectHDF5(setKey,simKeys,readCols)
+        else:
+            colData, simIdx = self._selectFile(setKey,simKeys,list(columns),where,nWorkers)
+
+        colData["SIM"] = np.repeat(np.array([self.simData.simList.index(k) for k in simKeys],dtype="int"),simIdx)
+        if self.dataType == self.TYPE_HDF5 and len(where) > 0 and len(colData["SIM"]) > 0:
+            rowMask = filterMask(colData,where)
+            colData = {cN:colData[cN][rowMask] for cN in list(columns)+["SIM"]}
+        else:
+            colData = {cN:colData[cN] for cN in list(columns)+["SIM"]}
+
+        return colData
+
     #
     #  Internal Functions
     #
 
+    def _selectHDF5(self, setKey, simKeys, readCols):
+        """Reads columns from the compound datasets of a set of HDF5 files. Returns the columns,
+        and the number of rows from each file.
+        """
+        simRows = []
+        colType = None
+        for simKey in simKeys:
+            h5Set = self.simData[simKey].get(setKey,None)
+            simRows.append(0 if h5Set is None else h5Set.shape[0])
+            if colType is None and h5Set is not None:
+                colType = self._selectTypes(h5Set,setKey,readCols)
+        if colType is None:
+            # None of the files have the dataset, so take the column types from another simulation
+            for simKey in self.simData.simList:
+                h5Set = self.simData[simKey].get(setKey,None)
+                if h5Set is not None:
+                    colType = self._selectTypes(h5Set,setKey,readCols)
+                    break
+
+        # Each column buffer is viewed as a compound type with only that field, so HDF5 copies
+        # the one field straight into it
+        rowBeg  = np.concatenate(([0],np.cumsum(simRows,dtype="int")))
+        colData = {cN:np.empty(rowBeg[-1],dtype=colType[cN]) for cN in readCols}
+        colView = {cN:colData[cN].view(np.dtype([(cN,colType[cN])])) for cN in readCols}
+
+        for s, simKey in enumerate(simKeys):
+            if simRows[s] == 0:
+                continue
+            h5Set = self.simData[simKey][setKey]
+            for cN in readCols:
+                h5Set.read_direct(colView[cN][rowBeg[s]:rowBeg[s+1]])
+
+        return colData, np.array(simRows,dtype="int")
+
+    def _selectTypes(self, h5Set, setKey, readCols):
+        """Checks that a compound dataset has the requested columns, and returns their types.
+        """
+        for cN in readCols:
+            if h5Set.dtype.names is None or cN not in h5Set.dtype.names:
+                raise KeyError("Column '%s' does not exist in dataset '%s'." % (cN,setKey))
+        return {cN:h5Set.dtype.fields[cN][0] for cN in readCols}
+
+    def _selectFile(self, setKey, simKeys, readCols, where, nWorkers):
+        """Reads columns from a set of text simulations, keeping only the rows matching where.
+        Returns the columns, and the number of rows from each simulation.
+        """
+        simData = []
+        for simKey in simKeys:
+            simWrap = self.simData[simKey]
+            if setKey not in simWrap:
+                simData.append(None)
+                continue
+            d = simWrap.readSet(setKey,columns=readCols,filterBy=where,nWorkers=nWorkers)
+            if d is None:
+                raise ValueError("Unable to read dataset '%s' of simulation '%s'." % (setKey,simKey))
+            simData.append(d)
+
+        simRows = np.array([0 if d is None else len(d[readCols[0]]) for d in simData],dtype="int")
+        simData = [d for d in simData if d is not None]
+        if len(simData) == 0:
+            # None of the simulations have the dataset, so take the column types from another one
+            for simKey in self.simData.simList:
+                if setKey in self.simData[simKey]:
+                    d = self.simData[simKey].readSet(setKey,columns=readCols,nWorkers=nWorkers)
+                    if d is not None:
+                        simData = [{cN:d[cN][:0] for cN in readCols}]
+                        break
+        if len(simData) == 0:
+            return {cN:np.zeros(0) for cN in readCols}, simRows
+
+        colData = {cN:np.concatenate([d[cN] for d in simData]) for cN in readCols}
+
+        return colData, simRows
+
     def _checkValid(self):
         if self.simData is None:
             raise ValueError("No simulation loaded.")
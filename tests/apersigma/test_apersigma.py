@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*
+"""Test Script for AperSigma Class
+
+  SixTrack Tools - Test Script for AperSigma Class
+ ==================================================
+  By: Veronica Berglyd Olsen
+      CERN (BE-ABP-HSS)
+      Geneva, Switzerland
+"""
+
+import numpy as np
+
+from os                import path
+from sttools.filetools import Aperture, TableFS
+from sttools.analysis  import AperSigma
+from sttools.constants import Const
+
+currPath = path.dirname(path.realpath(__file__))
+aperPath = path.join(currPath,"..","aperture")
+
+def testSigmaProfile():
+    latAper   = Aperture(aperPath,"lattice.tfs")
+    assert latAper.parseAperture()
+    twissData = TableFS(path.join(aperPath,"lattice.tfs"))
+
+    aperSig = AperSigma(latAper,twissData)
+    normEmit = np.array([2.5e-6,3.5e-6])
+    beamEn   = np.array([7.0e12,6.5e12])
+    nSigX, nSigY = aperSig.sigmaProfile(normEmit,beamEn,deltaP=1.0e-3)
+    assert nSigX.shape == (2,latAper.aperN)
+
+    beamGamma = beamEn[1]/Const.ProtonMass
+    geomEmit  = normEmit[1]/np.sqrt(beamGamma**2 - 1.0)
+    refSigX   = np.sqrt(geomEmit*twissData.Data["BETX"] + (twissData.Data["DX"]*1.0e-3)**2)
+    refSigY   = np.sqrt(geomEmit*twissData.Data["BETY"])
+    hasAper   = (latAper.aperX > 0.0) & (latAper.aperY > 0.0)
+    assert hasAper.any() and not hasAper.all()
+    assert np.allclose(nSigX[1,hasAper],latAper.aperX[hasAper]/refSigX[hasAper])
+    assert np.allclose(nSigY[1,hasAper],latAper.aperY[hasAper]/refSigY[hasAper])
+    assert np.isnan(nSigX[:,~hasAper]).all()
+
+    theBottle = aperSig.findBottlenecks(normEmit,beamEn,deltaP=1.0e-3,nBottle=3)
+    assert theBottle["NAMEY"].shape == (2,3)
+    minRow = np.nanargmin(nSigY[0])
+    assert theBottle["SIGY"][0,0] == nSigY[0,minRow]
+    # Slices are grouped under their parent element
+    assert theBottle["NAMEY"][0,0] == latAper.aperData.Data["NAME"][minRow].partition("..")[0]
+    assert len(set(theBottle["NAMEX"][0])) == 3
+    assert (np.diff(theBottle["SIGX"],axis=1) >= 0.0).all()
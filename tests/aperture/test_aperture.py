@@ -9,6 +9,7 @@
 """
 
 import filecmp as fcmp
+import numpy   as np
 
 from os                import path, unlink
 from sttools.filetools import Aperture
@@ -21,3 +22,45 @@ def testFileParse():
     assert lhcAper.parseAperture()
     #assert False
 
+def testParseValues():
+    assert lhcAper.parseAperture()
+    tfsData = lhcAper.aperData.Data
+    for n in range(lhcAper.aperN):
+        aperType = tfsData["APERTYPE"][n]
+        if aperType == "CIRCLE":
+            refX, refY = tfsData["APER_1"][n], tfsData["APER_1"][n]
+        elif aperType == "RECTELLIPSE":
+            refX = min(tfsData["APER_1"][n],tfsData["APER_3"][n])
+            refY = min(tfsData["APER_2"][n],tfsData["APER_4"][n])
+        elif aperType == "NONE":
+            refX, refY = 0.0, 0.0
+        else:
+            continue
+        assert lhcAper.aperX[n] == refX
+        assert lhcAper.aperY[n] == refY
+    assert lhcAper.aperX[tfsData["APERTYPE"] == "Q1_APERTURE"].max() == 0.04747
+
+def testCheckLost():
+    testAper = Aperture(currPath,"lattice.tfs")
+    sPos, xPos, yPos, isLost = np.array([
+        (0.5, 0.015, 0.015,1),(0.5, 0.010, 0.010,0),(6.5,-0.015, 0.015,1),
+        (1.5, 0.011, 0.000,1),(1.5,-0.009, 0.019,0),
+        (2.25,0.100, 0.100,0),
+        (2.75,0.015, 0.008,1),(2.75,0.010,-0.005,0),
+        (3.5, 0.016, 0.000,1),(3.5, 0.014, 0.019,1),(3.5,-0.014, 0.010,0),
+        (4.5, 0.014,-0.009,1),(4.5, 0.012, 0.008,0),
+        (5.5, 0.040, 0.000,0),(5.5, 0.040, 0.040,1),(5.5,-0.040,-0.010,0),
+    ]).T
+    assert (testAper.checkLost(sPos,xPos,yPos) == isLost.astype(bool)).all()
+
+def testProfileCache():
+    firstAper  = Aperture(currPath,"aperture.tfs.input")
+    secondAper = Aperture(currPath,"aperture.tfs.input")
+    wasFound, firstData = firstAper.customAperture("Q1_APERTURE")
+    assert wasFound
+    wasFound, secondData = secondAper.customAperture("Q1_APERTURE")
+    assert wasFound
+    assert firstData is secondData
+    assert firstData["Convex"]
+    assert firstData["Edges"].shape == (len(firstData["X"]),4)
+    assert firstData["BBox"] == (-0.04747,0.04747,-0.04747,0.04747)
@@ -9,6 +9,8 @@
 """
 
 import filecmp as fcmp
+import numpy   as np
+import h5py
 
 from os      import path, unlink
 from shutil  import copyfile
@@ -45,3 +47,59 @@ def testLoadFiles():
 # unlink(path.join(currPath,"test.001.hdf5"))
 # unlink(path.join(currPath,"test.002.hdf5"))
 # unlink(path.join(currPath,"test.003.hdf5"))
+
+def testWriteFullFile(tmp_path):
+    fullFile = path.join(str(tmp_path),"concatfile.h5")
+    assert fCC.writeFullFile(fullFile,blockSize=1000,chunkSize=512)
+    nFiles = len(fCC.fileList)
+    with h5py.File(path.join(currPath,"data.hdf5"),"r") as inFile:
+        inData = inFile["test/linopt"][:]
+    with h5py.File(fullFile,"r") as outFile:
+        assert len(outFile["SIMS"]) == nFiles
+        outSet = outFile["test/linopt"]
+        assert outSet.chunks == (512,)
+        assert outSet.compression == "gzip"
+        assert len(outSet) == nFiles*len(inData)
+        assert (outSet.fields("SIM")[:] == np.repeat(np.arange(nFiles),len(inData))).all()
+        assert (outSet.fields("BETAX")[-len(inData):] == inData["BETAX"]).all()
+        assert len(outFile["test/aperture/lostpart"]) == nFiles*50
+
+def testExtractAppend():
+    colData = fCC.extractAppend("test/aperture/lostpart","TURN")
+    assert len(colData) == len(fCC.fileList)*50
+
+def testWriteVirtualFile():
+    virtName = "virtualfile.h5"
+    assert fCC.writeVirtualFile(virtName,dataSets=["test/linopt","test/aperture/lostpart"])
+    nFiles = len([f for f in fCC.fileList if f != virtName])
+    with h5py.File(path.join(currPath,"data.hdf5"),"r") as inFile:
+        inData = inFile["test/aperture/lostpart"][:]
+    with h5py.File(path.join(currPath,virtName),"r") as virtFile:
+        assert virtFile["test/aperture/lostpart"].is_virtual
+        virtData = virtFile["test/aperture/lostpart"][:]
+        assert len(virtData) == nFiles*len(inData)
+        assert (virtData[-len(inData):] == inData).all()
+        simIdx = virtFile["SIM/test/aperture/lostpart"][:]
+        assert (simIdx == np.repeat(np.arange(nFiles),len(inData))).all()
+        assert len(virtFile["SIM/test/linopt"]) == nFiles*40901
+    unlink(path.join(currPath,virtName))
+
+def testWriteInSequence(tmp_path):
+    for simNo in (1,2):
+        copyfile(path.join(currPath,"data.hdf5"),path.join(str(tmp_path),"sim.%03d.hdf5" % simNo))
+    seqCC = Concatenator(str(tmp_path))
+    assert seqCC.loadAll()
+    assert seqCC.writeVirtualFile("v.h5")
+
+    # The outputs of earlier runs are not read as simulations
+    seqCC = Concatenator(str(tmp_path))
+    assert seqCC.loadAll()
+    assert seqCC.writeFullFile("full.h5")
+    seqCC = Concatenator(str(tmp_path))
+    assert seqCC.loadAll()
+    assert seqCC.writeVirtualFile("v2.h5")
+    assert len(seqCC.extractAppend("test/aperture/lostpart","TURN")) == 2*50
+    for outName in ("full.h5","v2.h5"):
+        with h5py.File(path.join(str(tmp_path),outName),"r") as outFile:
+            assert outFile["SIMS"][:].tolist() == [b"sim.001.hdf5",b"sim.002.hdf5"]
+            assert len(outFile["test/aperture/lostpart"]) == 2*50
@@ -13,7 +13,10 @@ import filecmp as fcmp
 from os      import path, unlink
 from hashlib import md5
 
-from sttools.h5tools import H5Import
+import numpy as np
+
+from sttools.h5tools   import H5Import
+from sttools.filetools import STDump, STDumpBin
 
 currPath         = path.dirname(path.realpath(__file__))
 hdf5File         = path.join(currPath,"test.hdf5")
@@ -37,6 +40,22 @@ def testLoadDumpFile():
     assert     h5Imp.importDump(dump5File)
     assert not h5Imp.importDump("non/existent/file")
 
+def testLoadBinaryDumpFile(tmp_path):
+    txtData = STDump(dump1File)
+    txtData.readAll()
+    binFile = path.join(str(tmp_path),"dump_ip1.bin")
+    binData = np.zeros(txtData.nLines,dtype=[("RECL_A","<i4")] + STDumpBin.FORMATS[3] + [("RECL_B","<i4")])
+    binData["RECL_A"] = binData["RECL_B"] = binData.dtype.itemsize - 8
+    for cN in txtData.colNames:
+        binData[cN] = txtData.allData[cN]
+    binData.tofile(binFile)
+    # Formats 3 and 8 have the same record layout, so the format must be given
+    assert not h5Imp.importDump(binFile,bezName="ip1_bin")
+    assert not h5Imp.importDump(binFile,bezName="ip1_bin",dumpFormat=8)
+    assert h5Imp.importDump(binFile,bezName="ip1_bin",dumpFormat=3)
+    assert (h5Imp.h5File["dump/ip1_bin"]["X"] == h5Imp.h5File["dump/ip1"]["X"]).all()
+    assert h5Imp.h5File["dump/ip1_bin"].attrs["NPART"] == 64
+
 def testLoadScatterLogFile():
     assert     h5Imp.importScatterLog(scatterLogFile)
     assert not h5Imp.importScatterLog(dump1File)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*
+"""Test Script for SPosIndex Class
+
+  SixTrack Tools - Test Script for SPosIndex Class
+ ==================================================
+  By: Veronica Berglyd Olsen
+      CERN (BE-ABP-HSS)
+      Geneva, Switzerland
+"""
+
+import numpy as np
+
+from os                import path
+from sttools.filetools import TableFS, SPosIndex
+
+currPath = path.dirname(path.realpath(__file__))
+latFile  = path.join(currPath,"..","aperture","lattice.tfs")
+
+def testLookup(tmp_path):
+    tfsData = TableFS(latFile)
+    sIndex  = SPosIndex(tfsData)
+    assert sIndex.findRows([0.0,0.5,1.0,2.25,2.75,3.5,5.5,6.5]).tolist() == [0,1,1,3,4,5,7,1]
+    assert sIndex.findNames([1.0,2.75,4.5]).tolist() == ["MQ.A","MB.B","MB.B"]
+
+    idxFile = path.join(str(tmp_path),"lattice.npz")
+    assert sIndex.save(idxFile)
+    sLoaded = SPosIndex.load(idxFile)
+    sTest   = np.random.uniform(0.0,12.0,1000)
+    assert (sLoaded.findRows(sTest) == sIndex.findRows(sTest)).all()
+
+def testShiftedLookup():
+    tfsData = TableFS(latFile)
+    assert tfsData.shiftSeq("MB.B..2")
+    sIndex  = SPosIndex(tfsData)
+    # MB.B..2 now covers [-1, 0], and wraps around to [5, 6)
+    assert sIndex.findNames([5.5,0.0,0.5,3.25]).tolist() == ["MB.B","MB.B","IP2","DRIFT_0"]
@@ -9,7 +9,14 @@
 """
 
 from os                import path, unlink
-from sttools.filetools import STDump
+import numpy as np
+import gzip
+import bz2
+import lzma
+import pytest
+
+from sttools.filetools import STDump, STDumpBin, ColCache
+from sttools.functions import openFile
 
 currPath         = path.dirname(path.realpath(__file__))
 dumpFile         = path.join(currPath,"dump_ip1.dat")
@@ -67,3 +74,136 @@ def testCollScatter():
     assert len(set(stData.colNames).intersection(
         ["ICOLL","ITURN","NP","NABS","DP","DX","DY"]
     )) == 7
+
+def testBulkParser():
+    for dataFile in (dumpFile,scatterLogFile,collSummaryFile,collFirstImpFile,collScatterFile):
+        bulkData = STDump(dataFile)
+        assert bulkData._readBulk()
+        lineData = STDump(dataFile)
+        lineData._readLines()
+        assert bulkData.nLines == lineData.nLines
+        for cN in lineData.colNames:
+            assert bulkData.allData[cN].dtype == lineData.allData[cN].dtype
+            assert (bulkData.allData[cN] == lineData.allData[cN]).all()
+
+def testIterChunks():
+    stData = STDump(dumpFile)
+    stData.readAll()
+    nRows = 0
+    for chunkData in stData.iterChunks(50):
+        assert len(chunkData) <= 50
+        assert (chunkData["X"] == stData.allData["X"][nRows:nRows+len(chunkData)]).all()
+        nRows += len(chunkData)
+    assert nRows == stData.nLines
+    assert stData.metaData["BEZ"] == "ip1"
+
+def testReadFiltered():
+    stData = STDump(dumpFile)
+    assert stData.readAll(columns=["ID","X"],filterBy={"TURN":(2,3),"ID":[1,2,11]})
+    assert list(stData.allData.keys()) == ["ID","X"]
+    assert stData.nLines == 6
+    stData.filterPart("ID",11)
+    assert len(stData.filData["X"]) == 2
+    assert not stData.readAll(columns=["NOSUCHCOL"])
+    nRows = 0
+    for chunkData in stData.iterChunks(20,columns=["TURN"],filterBy={"TURN":2}):
+        assert (chunkData["TURN"] == 2).all()
+        nRows += len(chunkData)
+    assert nRows == 64
+
+def testFilterIndex():
+    stData = STDump(dumpFile)
+    stData.readAll()
+    assert len(stData.idxData) == 0
+    assert stData.filterPart("TURN",(2,None))
+    assert len(stData.filData["TURN"]) == 128
+    assert "TURN" in stData.idxData
+    assert stData.filterPart("ID",[11,12,9999])
+    assert len(stData.filData["ID"]) == 6
+    assert (stData.filData["ID"] == [11,12,11,12,11,12]).all()
+    assert not stData.filterPart("ID",9999)
+    assert not stData.filterPart("X",1.0)
+
+def testReadParallel():
+    serData = STDump(dumpFile)
+    serData.readAll()
+    parData = STDump(dumpFile)
+    parData.RANGE_BYTES = 1000
+    assert parData.readAll(nWorkers=3)
+    assert parData.nLines == serData.nLines
+    for cN in serData.colNames:
+        assert (parData.allData[cN] == serData.allData[cN]).all()
+    assert parData.readAll(columns=["ID"],filterBy={"TURN":3},nWorkers=2)
+    assert parData.nLines == 64
+
+def testColCache(tmp_path):
+    colCache = ColCache(str(tmp_path))
+    stData = STDump(collSummaryFile,colCache=colCache)
+    assert stData.readAll()
+    assert not isinstance(stData.allData["NIMP"],np.memmap)
+    cacheData = STDump(collSummaryFile,colCache=colCache)
+    assert cacheData.readAll()
+    assert isinstance(cacheData.allData["NIMP"],np.memmap)
+    for cN in stData.colNames:
+        assert (cacheData.allData[cN] == stData.allData[cN]).all()
+    assert cacheData.readAll(columns=["COLLNAME"],filterBy={"NIMP":(1,None)})
+    assert stData.readAll(columns=["COLLNAME"],filterBy={"NIMP":(1,None)})
+    assert cacheData.nLines == stData.nLines == 13
+    assert (cacheData.allData["COLLNAME"] == stData.allData["COLLNAME"]).all()
+
+def testBinaryDump(tmp_path):
+    txtData = STDump(dumpFile)
+    txtData.readAll()
+    binFile = path.join(str(tmp_path),"dump_ip1.bin")
+    binType = np.dtype([("RECL_A","<i4")] + STDumpBin.FORMATS[3] + [("RECL_B","<i4")])
+    binData = np.zeros(txtData.nLines,dtype=binType)
+    binData["RECL_A"] = binData.dtype.itemsize - 8
+    binData["RECL_B"] = binData.dtype.itemsize - 8
+    for cN in txtData.colNames:
+        binData[cN] = txtData.allData[cN]
+    binData.tofile(binFile)
+    assert STDumpBin.isBinary(binFile)
+    assert not STDumpBin.isBinary(dumpFile)
+    stData = STDumpBin(binFile)
+    assert stData.validFile
+    assert stData.readAll()
+    assert stData.nLines == 192
+    for cN in txtData.colNames:
+        assert (stData.allData[cN] == txtData.allData[cN]).all()
+    assert stData.filterPart("ID",11)
+    assert len(stData.filData["TURN"]) == 3
+    assert sum(len(chunkData) for chunkData in stData.iterChunks(50,filterBy={"TURN":2})) == 64
+
+def testCompressedFiles(tmp_path):
+    txtData = STDump(dumpFile)
+    txtData.readAll()
+    with open(dumpFile,mode="rb") as inFile:
+        rawData = inFile.read()
+    for cmpMod, cmpExt in ((gzip,".gz"),(bz2,".bz2"),(lzma,".xz")):
+        cmpFile = path.join(str(tmp_path),"dump_ip1.dat"+cmpExt)
+        with cmpMod.open(cmpFile,mode="wb") as outFile:
+            outFile.write(rawData)
+        stData = STDump(cmpFile)
+        assert stData.metaData["BEZ"] == "ip1"
+        assert stData.readAll(nWorkers=2)
+        assert stData.nLines == 192
+        assert (stData.allData["X"] == txtData.allData["X"]).all()
+
+def testZstdFrames(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    txtData = STDump(dumpFile)
+    txtData.readAll()
+    with open(dumpFile,mode="rb") as inFile:
+        rawData = inFile.read()
+    # Write the file as several frames, like pzstd or concatenated .zst files
+    cmpFile = path.join(str(tmp_path),"dump_ip1.dat.zst")
+    zstComp = zstandard.ZstdCompressor()
+    with open(cmpFile,mode="wb") as outFile:
+        for rawBeg in range(0,len(rawData),4096):
+            outFile.write(zstComp.compress(rawData[rawBeg:rawBeg+4096]))
+    with openFile(cmpFile,"rb") as inFile:
+        assert inFile.read(len(rawData)) == rawData
+    stData = STDump(cmpFile)
+    assert stData.readAll()
+    assert stData.nLines == 192
+    assert (stData.allData["X"] == txtData.allData["X"]).all()
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*
+"""Test Script for TableFS Class
+  
+  SixTrack Tools - Test Script for TableFS Class
+ ================================================
+  By: Veronica Berglyd Olsen
+      CERN (BE-ABP-HSS)
+      Geneva, Switzerland
+"""
+
+import numpy as np
+import gzip
+
+from os                import path
+from sttools.filetools import TableFS, ColCache
+
+currPath = path.dirname(path.realpath(__file__))
+aperFile = path.join(currPath,"..","aperture","aperture.tfs.input")
+latFile  = path.join(currPath,"..","aperture","lattice.tfs")
+
+def testCompressedTable(tmp_path):
+    gzFile = path.join(str(tmp_path),"aperture.tfs.gz")
+    with open(aperFile,mode="rb") as inFile:
+        with gzip.open(gzFile,mode="wb") as outFile:
+            outFile.write(inFile.read())
+    tfsData = TableFS(gzFile)
+    assert tfsData.nLines == TableFS(aperFile).nLines
+    assert (tfsData.Data["S"] == TableFS(aperFile).Data["S"]).all()
+
+def testBulkParser():
+    tfsData = TableFS(aperFile)
+    bulkData = {vN:tfsData.Data[vN].copy() for vN in tfsData.varNames}
+    tfsData._readLines()
+    for vN in tfsData.varNames:
+        assert bulkData[vN].dtype == tfsData.Data[vN].dtype
+        assert (bulkData[vN] == tfsData.Data[vN]).all()
+    assert tfsData.Data["NAME"][0] == "IP1"
+
+def testCachedTable(tmp_path):
+    colCache = ColCache(str(tmp_path),useHash=True)
+    tfsFile  = aperFile
+    tfsData  = TableFS(tfsFile,colCache=colCache)
+    cacheData = TableFS(tfsFile,colCache=colCache)
+    assert cacheData.fileLoaded
+    assert isinstance(cacheData.Data["S"],np.memmap)
+    assert cacheData.varNames == tfsData.varNames
+    assert cacheData.metaData == tfsData.metaData
+    for vN in tfsData.varNames:
+        assert (cacheData.Data[vN] == tfsData.Data[vN]).all()
+
+    # In place edits work on a cache hit, and do not change the cache
+    cacheData.Data["S"][0] = -1.0
+    assert TableFS(tfsFile,colCache=colCache).Data["S"][0] == tfsData.Data["S"][0]
+
+def testCacheHashOnce(tmp_path, monkeypatch):
+    colCache = ColCache(str(tmp_path),useHash=True)
+    tfsFile  = aperFile
+    TableFS(tfsFile,colCache=colCache)
+    # The source file is only hashed once per cache hit
+    nHash    = []
+    fileMeta = colCache._fileMeta
+    def countMeta(srcFile, colNames):
+        nHash.append(srcFile)
+        return fileMeta(srcFile,colNames)
+    monkeypatch.setattr(colCache,"_fileMeta",countMeta)
+    assert TableFS(tfsFile,colCache=colCache).fileLoaded
+    assert len(nHash) == 1
+
+def testCacheEviction(tmp_path):
+    colCache = ColCache(str(tmp_path),maxSize=1)
+    for n in range(3):
+        tfsFile = path.join(str(tmp_path),"table%d.tfs" % n)
+        with open(aperFile,mode="rb") as inFile:
+            with open(tfsFile,mode="wb") as outFile:
+                outFile.write(inFile.read())
+        TableFS(tfsFile,colCache=colCache)
+    # Only the most recent entry is kept
+    assert colCache.loadInfo(path.join(str(tmp_path),"table0.tfs")) is None
+    assert colCache.loadInfo(path.join(str(tmp_path),"table2.tfs")) is not None
+
+def testSlicedRebuild():
+    tfsData = TableFS(latFile)
+    assert tfsData.slicedRebuild()
+    assert tfsData.sliceElem["NAME"].tolist() == ["MQ.A","MB.B"]
+    assert tfsData.sliceElem["SMIN"].tolist() == [1.0,3.0]
+    assert tfsData.sliceElem["SMAX"].tolist() == [4.0,5.0]
+    assert tfsData.sliceElem["FIRST"].tolist() == [1,4]
+    assert tfsData.sliceElem["LAST"].tolist() == [5,6]
+    assert tfsData.slicedRebuild(maxSearch=2)
+    assert tfsData.sliceElem["SMAX"].tolist() == [2.0,5.0]
+    assert tfsData.findElement("MB.B..2").tolist() == [6]
+    assert len(tfsData.findElement("MQ.B")) == 0
+    assert tfsData.findDataIndex("NAME","MQ\\.A") == [1,2,5]
+    assert tfsData.findDataIndex("NAME","IP[12]$") == [0,7]
+    assert tfsData.findDataIndex("NAME","M?.*..[!1]",isGlob=True) == [2,5,6]
+    assert tfsData.findDataIndex("KEYWORD","*DRIFT",isGlob=True) == [3]
+    assert tfsData.findDataIndex("NAME","IP1\\s") == []
+    assert tfsData.findDataIndex("NAME","(?i)ip1") == [0]
+    assert tfsData.findDataIndex("NAME","[^.]*2$") == [7]
+
+def testShiftAndView():
+    tfsData = TableFS(aperFile)
+    rawName = tfsData.Data["NAME"].copy()
+    rawS    = tfsData.Data["S"].copy()
+    sLength = tfsData.metaData["LENGTH"]
+
+    assert tfsData.shiftSeq(rawName[10])
+    assert tfsData.shiftSeq(rawName[30])
+    assert (tfsData.Data["NAME"] == np.roll(rawName,-30)).all()
+    refS = np.roll(rawS,-30) - rawS[30]
+    refS[refS < 0] += sLength
+    if refS[-1] == 0.0:
+        refS[-1] = sLength
+    assert np.allclose(tfsData.Data["S"],refS)
+    assert np.shares_memory(tfsData.Data["APER_1"],tfsData.seqData["APER_1"])
+
+    subView = tfsData.view(5,15)
+    assert subView.nLines == 10
+    assert (subView.Data["NAME"] == tfsData.Data["NAME"][5:15]).all()
+    assert np.shares_memory(subView.Data["APER_1"],tfsData.Data["APER_1"])
+
+    wrapView = tfsData.view(tfsData.nLines-5,5)
+    assert wrapView.nLines == 10
+    assert (wrapView.Data["NAME"] == np.roll(tfsData.Data["NAME"],5)[:10]).all()
+    assert np.shares_memory(wrapView.Data["APER_1"],tfsData.seqData["APER_1"])
+
+def testWrapView():
+    tfsData = TableFS(aperFile)
+    rawName = tfsData.Data["NAME"].copy()
+    nLines  = tfsData.nLines
+
+    # A view taken before a wrapping view keeps sharing memory with the table
+    subView  = tfsData.view(0,10)
+    wrapView = tfsData.view(nLines-16,8)
+    assert tfsData.seqData is None
+    assert np.shares_memory(subView.Data["APER_1"],tfsData.Data["APER_1"])
+    assert (wrapView.Data["NAME"] == np.roll(rawName,16)[:24]).all()
+
+    # Wrapping views past the end of the ring buffers after a shift
+    seqShift = nLines - nLines//4
+    assert tfsData.shiftSeq(rawName[seqShift])
+    for rowStart, rowStop in ((nLines-nLines//8,nLines//2),(nLines//2,nLines//2-1),(nLines-1,0)):
+        wrapView = tfsData.view(rowStart,rowStop)
+        nRows    = nLines - rowStart + rowStop
+        assert wrapView.nLines == nRows
+        for vN in tfsData.varNames:
+            assert len(wrapView.Data[vN]) == nRows
+        refName = np.roll(tfsData.Data["NAME"],nLines-rowStart)[:nRows]
+        assert (wrapView.Data["NAME"] == refName).all()
+        assert (wrapView.Data["APER_1"] == np.roll(tfsData.Data["APER_1"],nLines-rowStart)[:nRows]).all()
+        assert np.shares_memory(wrapView.Data["APER_1"],tfsData.seqData["APER_1"])
+
+def testShiftKeepsEdits():
+    tfsData = TableFS(aperFile)
+    rawName = tfsData.Data["NAME"].copy()
+    refAper = tfsData.Data["APER_1"].copy()
+
+    # Edits made between shifts are kept in every later rotation, as with np.roll
+    refShift = 0
+    for shiftIdx in (40, 150, 7, 120):
+        tfsData.Data["APER_1"][3] = 1.0 + shiftIdx
+        refAper[(refShift+3) % tfsData.nLines] = 1.0 + shiftIdx
+        newFirst = tfsData.Data["NAME"][shiftIdx]
+        refShift = (refShift + tfsData.findElement(newFirst)[0]) % tfsData.nLines
+        assert tfsData.shiftSeq(newFirst)
+        assert (tfsData.Data["NAME"] == np.roll(rawName,-refShift)).all()
+        assert (tfsData.Data["APER_1"] == np.roll(refAper,-refShift)).all()
+        wrapView = tfsData.view(tfsData.nLines-20,20)
+        assert (wrapView.Data["APER_1"] == np.roll(refAper,20-refShift)[:40]).all()
+        assert not wrapView.Data["APER_1"].flags.writeable
+
+def testSaveTable(tmp_path):
+    tfsData = TableFS(aperFile)
+    for outName in ("aperture.tfs","aperture.tfs.gz"):
+        outFile = path.join(str(tmp_path),outName)
+        assert tfsData.save(outFile)
+        outData = TableFS(outFile)
+        assert outData.varNames == tfsData.varNames
+        assert outData.varTypes == tfsData.varTypes
+        assert outData.metaData == tfsData.metaData
+        for vN in tfsData.varNames:
+            assert outData.Data[vN].dtype == tfsData.Data[vN].dtype
+            assert outData.Data[vN].tobytes() == tfsData.Data[vN].tobytes()
+
+    subFile = path.join(str(tmp_path),"subset.tfs")
+    assert tfsData.save(subFile,columns=["S","NAME"])
+    subData = TableFS(subFile)
+    assert subData.varNames == ["S","NAME"]
+    assert (subData.Data["NAME"] == tfsData.Data["NAME"]).all()
@@ -8,13 +8,19 @@
       Geneva, Switzerland
 """
 
-from os                import path, unlink, listdir
+import numpy as np
+import pytest
+import h5py
+
+from os                import path, unlink, listdir, makedirs
+from zipfile           import ZipFile
 from sttools           import loggingConfig, SixTrackSim, DataSet
 from sttools.h5tools   import H5Wrapper
-from sttools.filetools import FileWrapper
+from sttools.filetools import FileWrapper, STDump, STDumpBin
 
 currPath = path.dirname(path.realpath(__file__))
 h5Path   = path.join(currPath,"simdata","hdf5")
+dumpPath = path.join(currPath,"stdump")
 
 loggingConfig("DEBUG")
 
@@ -102,3 +108,154 @@ def testSimWrapperIter():
             assert aSim.attrs["CreatedBy"][0] == b"SixTrack 5.0.2"
             simNum += 1
         assert simNum == 3
+
+def testFileWrapperArchives(tmp_path):
+    for simNo in (1,2):
+        with ZipFile(path.join(str(tmp_path),"simFiles.%05d.zip" % simNo),"w") as zOut:
+            zOut.write(path.join(dumpPath,"dump_ip1.dat"),arcname="dump_ip1.dat")
+            zOut.write(path.join(dumpPath,"coll_summary.dat"),arcname="coll_summary.dat")
+    stSim = SixTrackSim(str(tmp_path))
+    assert stSim.dataType == SixTrackSim.TYPE_FILE
+    assert len(stSim) == 2
+    assert "simFiles.00002" in stSim
+    simNum = 0
+    for aSim in stSim:
+        assert "dump_ip1.dat" in aSim
+        assert len(aSim["dump_ip1.dat"]["X"]) == 192
+        assert aSim["coll_summary.dat"]["COLLNAME"][0] == "TCLX.4R1.B1"
+        simNum += 1
+    assert simNum == 2
+
+def writeSimFile(h5File, simNo):
+    with h5py.File(h5File,"w") as fH5:
+        fH5.attrs["CreatedBy"] = np.array([b"SixTrack 5.0"],dtype="S")
+        fH5.attrs["TimeStamp"] = np.array([b"2018-03-01T12:00:00.000"],dtype="S")
+        fH5.attrs["SimNumber"] = [simNo]
+        fH5.attrs["Particles"] = [64]
+        fH5.attrs["Turns"]     = [10]
+        for tN in ("PreTime","TrackTime","PostTime","TotalTime"):
+            fH5.attrs[tN] = [1.0]
+        fH5.create_dataset("collimation/dist0",data=np.zeros(64)+simNo)
+
+def testH5WrapperCatalog(tmp_path):
+    for simNo in (3,1,2):
+        writeSimFile(path.join(str(tmp_path),"data.%06d.hdf5" % simNo),simNo)
+    with open(path.join(str(tmp_path),"notes.txt"),"w") as outFile:
+        outFile.write("Not an HDF5 file\n")
+
+    # The catalog is only written when asked for
+    h5Sim = H5Wrapper(str(tmp_path))
+    assert not path.isfile(path.join(str(tmp_path),H5Wrapper.CATALOG_FILE))
+
+    h5Sim = H5Wrapper(str(tmp_path),nWorkers=2,useCatalog=True)
+    assert h5Sim.simList == ["data.000001","data.000002","data.000003"]
+    assert "collimation/dist0" in h5Sim.simSets
+    assert path.isfile(path.join(str(tmp_path),H5Wrapper.CATALOG_FILE))
+
+    # Changed files are scanned again, the rest are read from the catalog
+    writeSimFile(path.join(str(tmp_path),"data.000002.hdf5"),7)
+    h5Sim = H5Wrapper(str(tmp_path),useCatalog=True)
+    assert h5Sim.simList == ["data.000001","data.000003","data.000002"]
+    assert h5Sim.simMeta["data.000002"]["SimNumber"] == 7
+    assert h5Sim.simMeta["data.000001"]["SimPath"] == path.join(str(tmp_path),"data.000001.hdf5")
+
+def testH5WrapperForceAccept(tmp_path):
+    catPath = path.join(str(tmp_path),"catalog.json")
+    writeSimFile(path.join(str(tmp_path),"data.000001.hdf5"),1)
+    with h5py.File(path.join(str(tmp_path),"data.000001.hdf5"),"a") as fH5:
+        del fH5.attrs["CreatedBy"]
+
+    h5Sim = H5Wrapper(str(tmp_path),useCatalog=catPath)
+    assert h5Sim.simList == []
+    assert path.isfile(catPath)
+
+    # A file rejected without forceAccept is scanned again with it
+    h5Sim = H5Wrapper(str(tmp_path),useCatalog=catPath,forceAccept=True)
+    assert h5Sim.simList == ["data.000001"]
+    h5Sim = H5Wrapper(str(tmp_path),useCatalog=False,forceAccept=True)
+    assert h5Sim.simList == ["data.000001"]
+
+def testH5WrapperPool(tmp_path):
+    for simNo in (1,2,3):
+        writeSimFile(path.join(str(tmp_path),"data.%06d.hdf5" % simNo),simNo)
+    with H5Wrapper(str(tmp_path),maxOpen=2,useCatalog=False) as h5Sim:
+        firstFile = h5Sim[0]
+        assert h5Sim[0] is firstFile
+        assert firstFile["collimation/dist0"][0] == 1.0
+        h5Sim[1]
+        h5Sim[2]
+        assert len(h5Sim.h5Pool) == 2
+        assert not firstFile
+        assert h5Sim[0]["collimation/dist0"][0] == 1.0
+        openFiles = list(h5Sim.h5Pool.values())
+    assert len(h5Sim.h5Pool) == 0
+    assert not any(openFiles)
+
+def testBinaryDumpSet(tmp_path):
+    txtData = STDump(path.join(dumpPath,"dump_ip1.dat"))
+    txtData.readAll()
+    binData = np.zeros(txtData.nLines,dtype=[("RECL_A","<i4")] + STDumpBin.FORMATS[3] + [("RECL_B","<i4")])
+    binData["RECL_A"] = binData["RECL_B"] = binData.dtype.itemsize - 8
+    for cN in txtData.colNames:
+        binData[cN] = txtData.allData[cN]
+    for simName in ("sim1","sim2"):
+        makedirs(path.join(str(tmp_path),simName))
+        open(path.join(str(tmp_path),simName,"fort.3"),"w").close()
+        binData.tofile(path.join(str(tmp_path),simName,"dump_bin.dat"))
+
+    # The binary format cannot be detected, so it must be given
+    assert FileWrapper(str(tmp_path))["sim1"]["dump_bin.dat"] is None
+    fileSim = FileWrapper(str(tmp_path),dumpFormat={"dump_bin.dat":3})
+    assert (fileSim["sim1"]["dump_bin.dat"]["X"] == txtData.allData["X"]).all()
+    with SixTrackSim(str(tmp_path),dumpFormat={"dump_bin.dat":3}) as stSim:
+        assert (stSim["sim2"]["dump_bin.dat"]["ID"] == txtData.allData["ID"]).all()
+        selData = stSim.select("dump_bin.dat",["X"],where={"ID":11})
+        assert len(selData["X"]) == 2*np.count_nonzero(txtData.allData["ID"] == 11)
+        assert list(selData.keys()) == ["X","SIM"]
+
+    # A dataset that cannot be read is an error, not an empty simulation
+    with SixTrackSim(str(tmp_path)) as stSim:
+        with pytest.raises(ValueError,match="Unable to read dataset"):
+            stSim.select("dump_bin.dat",["X"])
+
+def testSelectHDF5(tmp_path):
+    for simNo in (1,2,3):
+        writeSimFile(path.join(str(tmp_path),"data.%06d.hdf5" % simNo),simNo)
+        with h5py.File(path.join(str(tmp_path),"data.%06d.hdf5" % simNo),"a") as fH5:
+            theData = np.zeros(10*simNo,dtype=[("ID","<i4"),("X","<f8"),("Y","<f8")])
+            theData["ID"] = np.arange(10*simNo)
+            theData["X"]  = simNo
+            theData["Y"]  = -simNo
+            fH5.create_dataset("collimation/coll_summary",data=theData)
+    with SixTrackSim(str(tmp_path)) as stSim:
+        selData = stSim.select("coll_summary",["X","ID"])
+        assert list(selData.keys()) == ["X","ID","SIM"]
+        assert len(selData["X"]) == 60
+        assert selData["X"].flags["C_CONTIGUOUS"]
+        assert (selData["X"] == selData["SIM"]+1).all()
+        selData = stSim.select("coll_summary",["Y"],where={"ID":(None,4)},sims=["data.000003",1])
+        assert (selData["SIM"] == np.repeat([2,1],5)).all()
+        assert (selData["Y"] == -selData["SIM"]-1).all()
+        selData = stSim.select("coll_summary",["ID","X"],where={"ID":(100,None)})
+        assert selData["ID"].dtype == np.dtype("<i4")
+        assert len(selData["X"]) == 0
+        selData = stSim.select("coll_summary",["ID"],sims=[])
+        assert selData["ID"].dtype == np.dtype("<i4")
+        assert len(selData["ID"]) == 0
+
+def testSelectFile(tmp_path):
+    for simNo in (1,2):
+        with ZipFile(path.join(str(tmp_path),"simFiles.%05d.zip" % simNo),"w") as zOut:
+            zOut.write(path.join(dumpPath,"dump_ip1.dat"),arcname="dump_ip1.dat")
+    with SixTrackSim(str(tmp_path)) as stSim:
+        selData = stSim.select("dump_ip1.dat",["X","ID"],where={"TURN":1})
+        dumpData = stSim[0]["dump_ip1.dat"]
+        nTurnOne = np.count_nonzero(dumpData["TURN"] == 1)
+        assert len(selData["X"]) == 2*nTurnOne
+        assert (selData["SIM"] == np.repeat([0,1],nTurnOne)).all()
+        assert (selData["X"][:nTurnOne] == dumpData["X"][dumpData["TURN"] == 1]).all()
+        selData = stSim.select("dump_ip1.dat",["ID"],sims=[])
+        assert selData["ID"].dtype == dumpData["ID"].dtype
+        assert len(selData["ID"]) == 0
+        with pytest.raises(KeyError,match="Column 'NOPE' does not exist"):
+            stSim.select("dump_ip1.dat",["NOPE","X"])
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*
+"""Test Script for TurnData Class
+  
+  SixTrack Tools - Test Script for TurnData Class
+ =================================================
+  By: Veronica Berglyd Olsen
+      CERN (BE-ABP-HSS)
+      Geneva, Switzerland
+"""
+
+import numpy as np
+import h5py
+
+from os                import path
+from sttools.filetools import STDump
+from sttools.analysis  import TurnData
+
+currPath = path.dirname(path.realpath(__file__))
+dumpFile = path.join(currPath,"..","stdump","dump_ip1.dat")
+
+stData = STDump(dumpFile)
+stData.readAll()
+
+def testBuildTensor():
+    theTensor, partIDs, turnNums = TurnData.buildTensor(stData.allData)
+    assert theTensor.shape == (64,3,6)
+    assert not np.ma.isMaskedArray(theTensor)
+    assert (turnNums == [1,2,3]).all()
+    stData.filterPart("ID",11)
+    assert (theTensor[10,:,0] == stData.filData["X"]).all()
+    assert (theTensor[10,:,5] == stData.filData["DEE"]).all()
+
+def testBuildMasked():
+    rowMask = ~((stData.allData["ID"] == 5) & (stData.allData["TURN"] == 3))
+    theTensor, partIDs, turnNums = TurnData.buildTensor(
+        {cN:stData.allData[cN][rowMask] for cN in stData.allData.keys()},colNames=["X","Y"]
+    )
+    assert np.ma.isMaskedArray(theTensor)
+    assert theTensor.mask.sum() == 2
+    assert theTensor.mask[4,2,0]
+
+def testWriteTensor(tmp_path):
+    memTensor, partIDs, turnNums = TurnData.buildTensor(stData.allData)
+    npyFile = path.join(str(tmp_path),"tensor.npy")
+    pIDs, tNums = TurnData.writeTensor(stData,npyFile,chunkSize=50)
+    assert (pIDs == partIDs).all()
+    assert (np.load(npyFile,mmap_mode="r") == memTensor).all()
+    h5File = path.join(str(tmp_path),"tensor.h5")
+    TurnData.writeTensor(stData.allData,h5File,chunkSize=70)
+    with h5py.File(h5File,"r") as h5Data:
+        assert (h5Data["tensor"][()] == memTensor).all()
+        assert (h5Data["TURN"][()] == turnNums).all()
+
+def testWriteTensorBlocks(tmp_path):
+    nPart, nTurn = 300, 40
+    partID  = np.tile(np.arange(1,nPart+1),nTurn)
+    turnNum = np.repeat(np.arange(1,nTurn+1),nPart)
+    rowKeep = np.random.RandomState(42).permutation(nPart*nTurn)[:-5]
+    dumpData = {"ID":partID[rowKeep],"TURN":turnNum[rowKeep],"X":partID[rowKeep]*1000.0+turnNum[rowKeep]}
+    memTensor, partIDs, turnNums = TurnData.buildTensor(dumpData,colNames=["X"],maskLost=False)
+    h5File = path.join(str(tmp_path),"tensor.h5")
+    TurnData.writeTensor(dumpData,h5File,colNames=["X"],chunkSize=500)
+    with h5py.File(h5File,"r") as h5Data:
+        h5Tensor = h5Data["tensor"][()]
+    assert np.isnan(h5Tensor).sum() == 5
+    assert np.array_equal(h5Tensor,memTensor,equal_nan=True)